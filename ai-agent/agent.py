@@ -1,91 +1,771 @@
 #!/usr/bin/env python3
-"""Autonomous AI Agent - Executes tasks with self-correction in <100 lines."""
-import os, json, subprocess, sys
+"""Autonomous AI Agent - Executes tasks with self-correction."""
+import os, re, json, time, queue, signal, asyncio, subprocess, sys, threading
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from pathlib import Path
-from anthropic import Anthropic
+from typing import AsyncIterator, Iterable, Optional, Tuple
+from anthropic import Anthropic, AsyncAnthropic
+
+MODEL = "claude-3-5-sonnet-20241022"
+READ_ONLY = {"read_file", "list_files", "search_code"}
+MAX_OUTPUT = 20000   # characters (~5k tokens) one tool result may add to the conversation
+PAGE = MAX_OUTPUT - 200  # paginated tools leave room for their footer, so it is never cut off
+COMPACT_AT = 50000   # prompt tokens (cached or not) after which older tool results are replaced by summaries
+KEEP_RECENT = 2      # tool-result turns that are never compacted
+
+# Runs inside the worker process: one JSON request per stdin line, one JSON reply per line on the
+# original stdout (fd 1 is pointed at stderr so stray C-level writes cannot corrupt the protocol).
+WORKER = r'''
+import ast, contextlib, io, json, os, signal, sys, traceback
+try:
+    import resource
+except ImportError:  # not POSIX: no resource limits
+    resource = None
+memory_mb, cpu_seconds = int(sys.argv[1]), int(sys.argv[2])
+if resource and memory_mb:
+    resource.setrlimit(resource.RLIMIT_AS, (memory_mb << 20,) * 2)
+
+def arm_cpu():
+    """Allow cpu_seconds more CPU time; past that SIGXCPU interrupts the code (children inherit the limit)."""
+    if resource and cpu_seconds:
+        usage, hard = resource.getrusage(resource.RUSAGE_SELF), resource.getrlimit(resource.RLIMIT_CPU)[1]
+        soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds
+        resource.setrlimit(resource.RLIMIT_CPU, (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+
+def over_cpu(signum, frame):
+    arm_cpu()  # a fresh budget, so the signal does not repeat while the error is reported
+    raise TimeoutError(f"CPU limit of {cpu_seconds}s per call exceeded")
+
+if resource and cpu_seconds:
+    signal.signal(signal.SIGXCPU, over_cpu)
+proto = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+namespace = {"__name__": "__main__"}
+for line in sys.stdin:
+    request, out, err = json.loads(line), io.StringIO(), io.StringIO()
+    if request.get("reset"):
+        namespace = {"__name__": "__main__"}
+    arm_cpu()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            tree = ast.parse(request.get("code", ""), "<code>")
+            last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+            exec(compile(tree, "<code>", "exec"), namespace)
+            if last is not None:
+                value = eval(compile(ast.Expression(last.value), "<code>", "eval"), namespace)
+                if value is not None:
+                    print(repr(value))
+        except BaseException:
+            kind, error, tb = sys.exc_info()
+            traceback.print_exception(kind, error, None if kind is SyntaxError else tb.tb_next)  # skip this loop's frame
+    proto.write(json.dumps({"stdout": out.getvalue(), "stderr": err.getvalue()}) + "\n")
+    proto.flush()
+'''
+
+class PythonWorker:
+    """Long-lived Python process for execute_code: imports and variables persist between calls.
+
+    The worker is limited in wall time (`timeout` per call), address space (`memory_mb`) and CPU time
+    (`cpu_seconds` per call); 0 disables a limit. It is not a sandbox: the code runs as the current
+    user with full file and network access.
+    """
+
+    def __init__(self, timeout: float = 10, memory_mb: int = 4096, cpu_seconds: int = 60):
+        self.timeout, self.memory_mb, self.cpu_seconds = timeout, memory_mb, cpu_seconds
+        self.proc, self.replies = None, None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        args = [sys.executable, "-u", "-c", WORKER, str(self.memory_mb), str(self.cpu_seconds)]
+        self.proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, start_new_session=True)
+        self.replies = queue.Queue()
+        threading.Thread(target=self._pump, args=(self.proc, self.replies), daemon=True).start()
+
+    @staticmethod
+    def _pump(proc: subprocess.Popen, replies: queue.Queue):
+        for line in proc.stdout:
+            replies.put(line)
+        replies.put(None)  # EOF: the worker died
+
+    def run(self, code: str, timeout: float = None) -> dict:
+        """Execute code in the shared namespace; returns {"stdout", "stderr"} or raises after restarting."""
+        return self._request({"code": code}, timeout or self.timeout)
+
+    def reset(self):
+        """Start the next task with an empty namespace (the process and its imports stay warm)."""
+        if self.proc is not None and self.proc.poll() is None:
+            try: self._request({"reset": True}, self.timeout)
+            except Exception: pass
+
+    def _request(self, request: dict, timeout: float) -> dict:
+        with self._lock:
+            if self.proc is None or self.proc.poll() is not None:
+                self._start()
+            try:
+                self.proc.stdin.write(json.dumps(request) + "\n")
+                self.proc.stdin.flush()
+                reply = self.replies.get(timeout=timeout)
+            except queue.Empty:
+                self.stop()
+                raise TimeoutError(f"timed out after {timeout}s; the interpreter was restarted and its variables lost")
+            except OSError:
+                reply = None
+            if reply is None:
+                self.stop()
+                raise RuntimeError("the interpreter crashed and was restarted; its variables were lost")
+            return json.loads(reply)
+
+    def stop(self):
+        if self.proc is None:
+            return
+        try: os.killpg(self.proc.pid, signal.SIGKILL)  # also kills anything the code spawned
+        except (AttributeError, OSError): self.proc.kill()
+        self.proc.wait()
+        self.proc = None
+
+def _literals(pattern: str) -> list:
+    """Literal runs (3+ chars) that every match of the regex must contain; [] means no filtering."""
+    if "|" in pattern or re.search(r"\\[xuUN0-9]", pattern):  # alternation, or escapes we do not decode
+        return []
+    runs, run, depth, i = [], "", 0, 0
+    while i < len(pattern):
+        ch, literal = pattern[i], None
+        if ch == "\\" and i + 1 < len(pattern):
+            i += 1
+            literal = None if pattern[i].isalnum() else pattern[i]  # \w, \b... are classes; \. \( are literals
+        elif ch in "?*{":  # the previous character is optional
+            run = run[:-1]
+            i = max(i, pattern.find("}", i)) if ch == "{" else i
+        elif ch == "[":
+            end = pattern.find("]", i + 2)
+            i = end if end != -1 else len(pattern)
+        elif ch not in ".^$+()":
+            literal = ch
+        if literal is not None:
+            run += literal
+            i += 1
+            continue
+        if depth == 0 and len(run) >= 3:  # runs inside groups may be optional or repeated
+            runs.append(run)
+        run, depth, i = "", depth + (ch == "(") - (ch == ")"), i + 1
+    return runs + ([run] if depth == 0 and len(run) >= 3 else [])
+
+def _ignore_rules(directory: str) -> list:
+    """(regex, negated, dirs only, base) rules from directory/.gitignore."""
+    try:
+        with open(os.path.join(directory, ".gitignore"), encoding="utf-8", errors="replace") as f: lines = f.read().splitlines()
+    except OSError:
+        return []
+    rules = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        negated, line = line.startswith("!"), line.lstrip("!")
+        dir_only, line = line.endswith("/"), line.rstrip("/")
+        anchored, line = "/" in line, line.lstrip("/")  # "a/b" and "/a" match from the .gitignore's directory
+        body = re.sub(r"\\\*\\\*/|\\\*\\\*|\\\*|\\\?", lambda m: {"\\*\\*/": "(.*/)?", "\\*\\*": ".*", "\\*": "[^/]*",
+                                                                   "\\?": "[^/]"}[m.group()], re.escape(line))
+        rules.append((re.compile(("" if anchored else "(.*/)?") + body + "$"), negated, dir_only, directory))
+    return rules
+
+def _inherited_rules(root: str) -> list:
+    """Rules of root's .gitignore and those of its ancestors up to the repository top (the directory holding .git)."""
+    chain, directory = [root], root
+    while not os.path.exists(os.path.join(directory, ".git")):
+        parent = os.path.dirname(directory)
+        if parent == directory:  # not in a repository: only root's own rules
+            chain = [root]
+            break
+        directory = parent
+        chain.append(directory)
+    return [rule for directory in reversed(chain) for rule in _ignore_rules(directory)]
+
+def _ignored(path: str, is_dir: bool, rules: list) -> bool:
+    ignored = False
+    for regex, negated, dir_only, base in rules:  # the last matching rule wins, as in git
+        if (is_dir or not dir_only) and regex.match(os.path.relpath(path, base).replace(os.sep, "/")):
+            ignored = not negated
+    return ignored
+
+class CodeIndex:
+    """Trigram index over a directory tree for search_code: built on first use, refreshed from mtimes."""
+    MAX_BYTES = 1 << 20  # larger files (generated code, data dumps) are not searched
+
+    def __init__(self, root: str):
+        self.root = root
+        self.files = {}     # path -> (file id or None if skipped, mtime, size)
+        self.paths = []     # file id -> path; None once the file changed or disappeared
+        self.postings = {}  # lowercase byte trigram -> array of file ids
+        self.stale = 0
+        self._lock = threading.Lock()
+
+    def _walk(self):
+        """Files under root, skipping .git, .gitignore'd paths and symlinks."""
+        stack = [(self.root, _inherited_rules(self.root))]
+        while stack:
+            directory, rules = stack.pop()
+            try: entries = list(os.scandir(directory))
+            except OSError: continue
+            for entry in entries:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if entry.name == ".git" or _ignored(entry.path, is_dir, rules):
+                    continue
+                if is_dir:
+                    stack.append((entry.path, rules + _ignore_rules(entry.path)))
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path, entry.stat()
+
+    def refresh(self):
+        """Index new and modified files and forget deleted ones; rebuilds once most postings are stale."""
+        seen = set()
+        for path, stat in self._walk():
+            seen.add(path)
+            known = self.files.get(path)
+            if known is None or known[1:] != (stat.st_mtime, stat.st_size):
+                self._forget(path)
+                self._add(path, stat)
+        for path in [p for p in self.files if p not in seen]:
+            self._forget(path)
+        if self.stale > max(1000, len(self.files)):
+            self.files, self.paths, self.postings, self.stale = {}, [], {}, 0
+            self.refresh()
+
+    def _add(self, path: str, stat: os.stat_result):
+        try:
+            with open(path, "rb") as f: data = f.read(self.MAX_BYTES + 1)
+        except OSError:
+            return
+        if len(data) > self.MAX_BYTES or b"\0" in data[:8192]:  # too large, or binary
+            self.files[path] = (None, stat.st_mtime, stat.st_size)
+            return
+        file_id = len(self.paths)
+        self.paths.append(path)
+        self.files[path] = (file_id, stat.st_mtime, stat.st_size)
+        data = data.lower()
+        for gram in set(zip(data, data[1:], data[2:])):
+            ids = self.postings.get(gram)
+            if ids is None:
+                ids = self.postings[gram] = array("I")
+            ids.append(file_id)
+
+    def _forget(self, path: str):
+        file_id = self.files.pop(path, (None,))[0]
+        if file_id is not None:
+            self.paths[file_id] = None
+            self.stale += 1
+
+    def search(self, pattern: str, path: str, max_lines: int = 50, per_file: int = 5) -> str:
+        """Regex search ranked by matches per file; at most per_file lines per file and max_lines in total."""
+        try: regex = re.compile(pattern)
+        except re.error: regex, pattern = re.compile(re.escape(pattern)), re.escape(pattern)  # search it literally
+        grams = set()
+        for run in _literals(pattern):
+            data = run.encode().lower()
+            grams |= set(zip(data, data[1:], data[2:]))
+        with self._lock:
+            self.refresh()
+            lists = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+            ids = set(lists[0]).intersection(*lists[1:]) if lists else range(len(self.paths))
+            candidates = [self.paths[i] for i in ids if self.paths[i] is not None]
+        prefix = os.path.abspath(path)
+        hits = []
+        for file in candidates:
+            if file != prefix and not file.startswith(prefix.rstrip(os.sep) + os.sep):
+                continue
+            try:
+                with open(file, encoding="utf-8", errors="replace") as f:
+                    matches = [(n, line) for n, line in enumerate(f, 1) if regex.search(line)]
+            except OSError:
+                continue
+            if matches:
+                hits.append((len(matches), os.path.relpath(file), matches))
+        hits.sort(key=lambda hit: (-hit[0], hit[1]))
+        out, total = [], sum(hit[0] for hit in hits)
+        for _, file, matches in hits:
+            out += [f"{file}:{n}: {line.strip()[:200]}" for n, line in matches[:per_file]][:max_lines - len(out)]
+        if total > len(out):
+            out.append(f"... {total - len(out)} more matching lines ({total} in {len(hits)} files); narrow the pattern or path")
+        return "\n".join(out) or "No matches"
+
+def _overlap(a: Optional[str], b: Optional[str]) -> bool:
+    """Whether two absolute paths are the same or one contains the other; None stands for every path."""
+    if a is None or b is None:
+        return True
+    a, b = sorted((a.rstrip(os.sep), b.rstrip(os.sep)), key=len)
+    return a == b or b.startswith(a + os.sep)
+
+def context_tokens(usage) -> int:
+    """Whole prompt size of a turn: with a cache breakpoint, input_tokens counts only the uncached part."""
+    return (usage.input_tokens + (getattr(usage, "cache_read_input_tokens", None) or 0)
+            + (getattr(usage, "cache_creation_input_tokens", None) or 0))
+
+class ToolCache:
+    """Per-run memo of read-only tool results, keyed by tool name and arguments.
+
+    Each entry remembers the mtime and size of its path (the file read, or the directory listed
+    or searched) and is only used while they are unchanged. write_file drops the entries for its
+    path and the directories above it; execute_code, which can touch anything, drops every
+    listing and search. A write inside a directory need not change the directory's own mtime, so
+    results from calls that started before the latest invalidation are not stored at all.
+    """
+
+    def __init__(self):
+        self.entries = {}  # (name, args JSON) -> (stamp, result)
+        self.hits = self.misses = 0
+        self.generation = 0  # bumped by every invalidate()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, args: dict) -> tuple:
+        return name, json.dumps(args, sort_keys=True)
+
+    @staticmethod
+    def stamp(args: dict) -> Optional[tuple]:
+        try: stat = os.stat(args.get("path", "."))
+        except OSError: return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, name: str, args: dict, stamp: Optional[tuple]) -> Optional[str]:
+        with self._lock:
+            entry = self.entries.get(self._key(name, args))
+            if entry is not None and stamp is not None and entry[0] == stamp:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, name: str, args: dict, stamp: Optional[tuple], generation: int, result: str):
+        """Store result unless the call failed or a write was seen since it started (at generation)."""
+        if stamp is not None and not result.startswith("Error:"):
+            with self._lock:
+                if generation == self.generation:
+                    self.entries[self._key(name, args)] = (stamp, result)
+
+    def invalidate(self, path: str = None):
+        """Forget results that may have changed because path was written (any file, if None)."""
+        written = os.path.abspath(path) if path else None
+        with self._lock:
+            self.generation += 1
+            for key in list(self.entries):
+                name, args = key[0], json.loads(key[1])
+                cached = os.path.abspath(args.get("path", "."))
+                if written is None and name != "read_file" or \
+                        written is not None and (written == cached or written.startswith(cached.rstrip(os.sep) + os.sep)):
+                    del self.entries[key]
+
+class Tracer:
+    """Timed spans of a run - model turns and tool calls - exported as JSONL or a Chrome trace."""
+
+    def __init__(self):
+        self.spans = []
+        self.iteration = 0
+        self.origin = time.perf_counter()
+        self._threads = {threading.get_ident(): 0}  # Chrome trace rows: 0 is the model loop
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, name: str, start: float, **fields):
+        """Record a span from start (a perf_counter() value) until now."""
+        end = time.perf_counter()
+        with self._lock:
+            tid = self._threads.setdefault(threading.get_ident(), len(self._threads))
+            self.spans.append({"kind": kind, "name": name, "iteration": self.iteration, "thread": tid,
+                               "start_ms": (start - self.origin) * 1000, "ms": (end - start) * 1000, **fields})
+
+    def export(self, path: str):
+        """JSONL (one span per line) for .jsonl paths, otherwise Chrome trace events (chrome://tracing, Perfetto)."""
+        with open(path, "w") as f:
+            if path.endswith(".jsonl"):
+                f.writelines(json.dumps(span) + "\n" for span in self.spans)
+                return
+            events = [{"name": s["name"], "cat": s["kind"], "ph": "X", "ts": s["start_ms"] * 1000, "dur": s["ms"] * 1000,
+                       "pid": os.getpid(), "tid": s["thread"],
+                       "args": {k: v for k, v in s.items() if k not in ("name", "kind", "start_ms", "ms", "thread")}}
+                      for s in self.spans]
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self) -> str:
+        """Per-iteration and per-tool tables, and where the wall time went."""
+        models = [s for s in self.spans if s["kind"] == "model"]
+        tools = [s for s in self.spans if s["kind"] == "tool"]
+        lines = [f"{'iter':>4} {'model ms':>9} {'ttft ms':>8} {'in tok':>7} {'out tok':>7} {'stop':<10} {'tools':>5} {'tool ms':>8}"]
+        for s in models:
+            mine = [t for t in tools if t["iteration"] == s["iteration"]]
+            lines.append(f"{s['iteration']:>4} {s['ms']:>9.0f} {s['ttft_ms']:>8.0f} {s['input_tokens']:>7} {s['output_tokens']:>7} "
+                         f"{s['stop_reason']:<10} {len(mine):>5} {sum(t['ms'] for t in mine):>8.0f}")
+        lines.append(f"\n{'tool':<14} {'calls':>5} {'cached':>6} {'total ms':>9} {'max ms':>8} {'chars':>8}")
+        for name in sorted({t["name"] for t in tools}):
+            mine = [t for t in tools if t["name"] == name]
+            lines.append(f"{name:<14} {len(mine):>5} {sum(t['cached'] for t in mine):>6} {sum(t['ms'] for t in mine):>9.0f} "
+                         f"{max(t['ms'] for t in mine):>8.0f} {sum(t['chars'] for t in mine):>8}")
+        wall = max((s["start_ms"] + s["ms"] for s in self.spans), default=0)
+        lines.append(f"\nwall {wall / 1000:.1f}s: model {sum(s['ms'] for s in models) / 1000:.1f}s, tools "
+                     f"{sum(t['ms'] for t in tools) / 1000:.1f}s (summed; tools overlap generation and each other), "
+                     f"input tokens {sum(s['input_tokens'] for s in models)} (last turn {models[-1]['input_tokens'] if models else 0})")
+        return "\n".join(lines)
 
 class Agent:
-    def __init__(self, api_key: str = None):
-        self.client = Anthropic(api_key=api_key or os.getenv("ANTHROPIC_API_KEY"))
+    def __init__(self, api_key: str = None, client=None):
+        self.client = client or Anthropic(api_key=api_key or os.getenv("ANTHROPIC_API_KEY"))
         self.conversation = []
+        self.worker = PythonWorker()
+        self.tool_cache = ToolCache()
+        self.tracer = Tracer()
+        self.indexes = {}  # root directory -> CodeIndex, built on the first search under it
+        self._index_lock = threading.Lock()
         self.tools = [
-            {"name": "execute_code", "description": "Execute Python code safely",
+            {"name": "execute_code", "description": "Execute Python code in a separate, persistent interpreter: "
+                                                    "imports and variables carry over between calls within the task, "
+                                                    "and the value of a final expression is printed. Each call is "
+                                                    f"limited to {self.worker.timeout:g}s, {self.worker.cpu_seconds}s "
+                                                    f"of CPU time and {self.worker.memory_mb} MB of memory",
              "input_schema": {"type": "object", "properties": {"code": {"type": "string"}}, "required": ["code"]}},
-            {"name": "read_file", "description": "Read file contents",
-             "input_schema": {"type": "object", "properties": {"path": {"type": "string"}}, "required": ["path"]}},
+            {"name": "read_file", "description": "Read file contents, at most `limit` lines (default 500) from line "
+                                                 "`offset` (1-based); a footer says how to read the rest",
+             "input_schema": {"type": "object", "properties": {"path": {"type": "string"}, "offset": {"type": "integer"},
+                                                               "limit": {"type": "integer"}}, "required": ["path"]}},
             {"name": "write_file", "description": "Write content to file",
              "input_schema": {"type": "object", "properties": {"path": {"type": "string"}, "content": {"type": "string"}}, "required": ["path", "content"]}},
-            {"name": "list_files", "description": "List files in directory",
-             "input_schema": {"type": "object", "properties": {"path": {"type": "string"}}, "required": ["path"]}},
-            {"name": "search_code", "description": "Search for pattern in files",
-             "input_schema": {"type": "object", "properties": {"pattern": {"type": "string"}, "path": {"type": "string"}}, "required": ["pattern"]}},
+            {"name": "list_files", "description": "List files in directory recursively, sorted, `limit` entries "
+                                                  "(default 200) after skipping `offset`",
+             "input_schema": {"type": "object", "properties": {"path": {"type": "string"}, "offset": {"type": "integer"},
+                                                               "limit": {"type": "integer"}}, "required": ["path"]}},
+            {"name": "search_code", "description": "Search files for a regex (Python syntax) and return line-numbered "
+                                                   "matches, files with the most matches first (capped at 50 lines); "
+                                                   "skips .gitignore'd and binary files",
+             "input_schema": {"type": "object", "properties": {"pattern": {"type": "string"}, "path": {"type": "string"}}, "required": ["pattern"]},
+             "cache_control": {"type": "ephemeral"}},  # the tools alone are below the minimum; see messages()
         ]
 
     def execute_code(self, code: str) -> str:
-        try: return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, timeout=10).stdout or "✓ Code executed"
+        try: out = self.worker.run(code)
         except Exception as e: return f"Error: {e}"
+        return out["stdout"] + (f"\n[stderr]\n{out['stderr']}" if out["stderr"] else "") or "✓ Code executed"
 
-    def read_file(self, path: str) -> str:
-        try: return Path(path).read_text()
+    def read_file(self, path: str, offset: int = 1, limit: int = 500) -> str:
+        first = max(offset, 1)
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                lines, size, total = [], 0, 0
+                for total, line in enumerate(f, 1):  # keep a contiguous run of lines that fits the budget
+                    if total == first + len(lines) and len(lines) < limit and (not lines or size + len(line) <= PAGE):
+                        lines.append(line[:PAGE])
+                        size += len(line)
         except Exception as e: return f"Error: {e}"
+        end = first + len(lines) - 1
+        if first == 1 and end == total:
+            return "".join(lines)
+        more = f"; read_file offset={end + 1} for more" if end < total else ""
+        return "".join(lines) + f"\n[lines {first}-{end} of {total}{more}]"
 
     def write_file(self, path: str, content: str) -> str:
         try: Path(path).write_text(content); return f"✓ Written to {path}"
         except Exception as e: return f"Error: {e}"
 
-    def list_files(self, path: str) -> str:
-        try: return "\n".join(str(p) for p in Path(path).rglob("*") if p.is_file())
+    def list_files(self, path: str, offset: int = 0, limit: int = 200) -> str:
+        try: files = sorted(str(p) for p in Path(path).rglob("*") if p.is_file())
         except Exception as e: return f"Error: {e}"
+        page, size = [], 0
+        for name in files[max(offset, 0):max(offset, 0) + limit]:
+            size += len(name) + 1
+            if page and size > PAGE:
+                break
+            page.append(name)
+        if len(page) == len(files):
+            return "\n".join(files)
+        more = f"; list_files offset={offset + len(page)} for more" if offset + len(page) < len(files) else ""
+        return "\n".join(page) + f"\n[files {offset + 1}-{offset + len(page)} of {len(files)}{more}]"
 
     def search_code(self, pattern: str, path: str = ".") -> str:
-        try: return subprocess.run(["grep", "-r", pattern, path], capture_output=True, text=True).stdout or "No matches"
+        try: return self._code_index(path).search(pattern, path)
         except Exception as e: return f"Error: {e}"
 
+    def _code_index(self, path: str) -> CodeIndex:
+        """The index covering path, reusing one built for a parent directory."""
+        path = os.path.abspath(path)
+        root = path if os.path.isdir(path) else os.path.dirname(path)
+        with self._index_lock:
+            for known, index in self.indexes.items():
+                if root == known or root.startswith(known.rstrip(os.sep) + os.sep):
+                    return index
+            return self.indexes.setdefault(root, CodeIndex(root))
+
     def call_tool(self, name: str, args: dict) -> str:
         tools_map = {"execute_code": self.execute_code, "read_file": self.read_file,
                      "write_file": self.write_file, "list_files": self.list_files, "search_code": self.search_code}
-        return tools_map[name](**args) if name in tools_map else "Unknown tool"
+        start = time.perf_counter()
+        generation = self.tool_cache.generation  # both taken first: a change mid-call stays visible
+        stamp = self.tool_cache.stamp(args) if name in READ_ONLY else None
+        cached = self.tool_cache.get(name, args, stamp) if name in READ_ONLY else None
+        if cached is not None:
+            self.tracer.add("tool", name, start, cached=True, chars=len(cached))
+            return cached
+        result = tools_map[name](**args) if name in tools_map else "Unknown tool"
+        if len(result) > MAX_OUTPUT:
+            half = MAX_OUTPUT // 2  # keep both ends: errors and summaries tend to be at the bottom
+            result = f"{result[:half]}\n... [{len(result) - 2 * half} characters omitted] ...\n{result[-half:]}"
+        if name in READ_ONLY:
+            self.tool_cache.put(name, args, stamp, generation, result)
+        elif name in ("write_file", "execute_code"):
+            self.tool_cache.invalidate(args.get("path") if name == "write_file" else None)
+        self.tracer.add("tool", name, start, cached=False, chars=len(result))
+        return result
+
+    def dispatch(self, pool: ThreadPoolExecutor, earlier: list, name: str, args: dict) -> Future:
+        """Start the next call of a turn on pool; earlier holds the turn's (scope, writes, future) so far.
+
+        A call waits for every earlier call it conflicts with: a write and any call whose path is
+        the same, inside or above it. execute_code can touch any path, so it waits for everything
+        before it and everything after waits for it. Only read-only tools overlap freely.
+        """
+        scope = None if name == "execute_code" else os.path.abspath(args.get("path") or ".")
+        writes = name not in READ_ONLY
+        before = [future for other, other_writes, future in earlier
+                  if (writes or other_writes) and _overlap(scope, other)]
+        future = pool.submit(self._call_after, before, name, args)
+        earlier.append((scope, writes, future))
+        return future
+
+    def _call_after(self, before: list, name: str, args: dict) -> str:
+        wait(before)  # submitted earlier, so they are already running or ahead in the queue
+        try: return self.call_tool(name, args)
+        except Exception as e: return f"Error: {e}"
+
+    def messages(self) -> list:
+        """The conversation with a cache breakpoint on its newest block, so each request reuses the
+        previous one's prefix (tools, task and every earlier turn). The stored history stays unmarked."""
+        *history, last = self.conversation
+        content = last["content"]
+        blocks = [{"type": "text", "text": content}] if isinstance(content, str) else list(content)
+        blocks[-1] = {**blocks[-1], "cache_control": {"type": "ephemeral"}}
+        return history + [{**last, "content": blocks}]
+
+    def compact(self):
+        """Replace tool results (and long tool inputs) older than KEEP_RECENT turns with one-line summaries."""
+        calls = {}
+        turns = [i for i, m in enumerate(self.conversation) if m["role"] == "user" and isinstance(m["content"], list)]
+        for message in self.conversation[:turns[-KEEP_RECENT] if len(turns) >= KEEP_RECENT else 0]:
+            if message["role"] == "assistant":
+                message["content"] = [self._compact_call(block, calls) for block in message["content"]]
+                continue
+            for result in message["content"] if isinstance(message["content"], list) else []:
+                content = result["content"]
+                if len(content) > 200 and not content.startswith("[compacted]"):
+                    name, args = calls.get(result["tool_use_id"], ("tool", {}))
+                    first = next((line.strip() for line in content.splitlines() if line.strip()), "")[:100]
+                    result["content"] = (f"[compacted] {name}({json.dumps(args)[:100]}) returned {len(content)} characters, "
+                                         f"{content.count(chr(10)) + 1} lines, starting: {first} (call again if needed)")
+
+    @staticmethod
+    def _compact_call(block, calls: dict):
+        """A tool_use block (SDK object or dict) with string inputs over 200 characters elided."""
+        if (block["type"] if isinstance(block, dict) else block.type) != "tool_use":
+            return block
+        block = block if isinstance(block, dict) else {"type": "tool_use", "id": block.id, "name": block.name, "input": block.input}
+        block["input"] = {k: f"[compacted: {len(v)} characters]" if isinstance(v, str) and len(v) > 200 else v
+                          for k, v in block["input"].items()}
+        calls[block["id"]] = (block["name"], block["input"])
+        return block
 
     def run(self, task: str, max_iterations: int = 10) -> str:
+        self.worker.reset()
+        self.tool_cache = ToolCache()
+        self.tracer = Tracer()
         self.conversation = [{"role": "user", "content": f"Task: {task}\n\nComplete this task using available tools. Be concise and efficient."}]
 
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            for i in range(max_iterations):
+                self.tracer.iteration = i + 1
+                response, calls = self.stream_turn(pool)
+
+                self.conversation.append({"role": "assistant", "content": response.content})
+                if context_tokens(response.usage) > COMPACT_AT:
+                    self.compact()
+
+                if response.stop_reason == "end_turn":
+                    result = next((block.text for block in response.content if hasattr(block, "text")), "Task completed")
+                    hits = self.tool_cache.hits
+                    print(f"\n✓ Agent completed task in {i+1} iterations"
+                          f"{f' ({hits} of {hits + self.tool_cache.misses} read-only tool calls cached)' if hits else ''}")
+                    return result
+
+                if response.stop_reason == "tool_use":
+                    tool_results = []
+                    for block, future in calls:
+                        result = future.result()
+                        print(f"  {block.name}: {result[:100]}{'...' if len(result) > 100 else ''}")
+                        tool_results.append({"type": "tool_result", "tool_use_id": block.id, "content": result})
+
+                    self.conversation.append({"role": "user", "content": tool_results})
+
+        return "⚠ Max iterations reached"
+
+    def stream_turn(self, pool: ThreadPoolExecutor) -> tuple:
+        """Stream one model turn, printing text as it arrives and starting each tool as soon as its input is complete.
+
+        Returns the final message and (tool_use block, future result) pairs in block order.
+        """
+        calls, earlier, start, first = [], [], time.perf_counter(), None
+        with self.client.messages.stream(model=MODEL, max_tokens=4096,
+                                         tools=self.tools, messages=self.messages()) as stream:
+            for event in stream:
+                first = first or time.perf_counter()
+                if event.type == "text":
+                    print(event.text, end="", flush=True)
+                elif event.type == "content_block_stop" and event.content_block.type == "text":
+                    print()
+                elif event.type == "content_block_stop" and event.content_block.type == "tool_use":
+                    block = event.content_block
+                    print(f"→ Using tool: {block.name}")
+                    calls.append((block, self.dispatch(pool, earlier, block.name, block.input)))
+            response = stream.get_final_message()
+        self.trace_turn(response, len(calls), start, first)
+        return response, calls
+
+    def trace_turn(self, response, tool_calls: int, start: float, first: Optional[float]):
+        usage = response.usage
+        self.tracer.add("model", "messages.stream", start, ttft_ms=((first or start) - start) * 1000,
+                        input_tokens=context_tokens(usage), output_tokens=usage.output_tokens,
+                        cache_read_tokens=getattr(usage, "cache_read_input_tokens", None) or 0,
+                        stop_reason=response.stop_reason, tool_calls=tool_calls)
+
+class TokenBucket:
+    """Async token bucket refilled at `rate` units per minute, holding at most `capacity` (default: one minute's worth)."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate, self.capacity = rate / 60, capacity or rate
+        self.level, self.stamp = self.capacity, time.monotonic()
+        self._lock = asyncio.Lock()  # waiters are served in arrival order
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level, self.stamp = min(self.capacity, self.level + (now - self.stamp) * self.rate), now
+
+    async def take(self, amount: float = 1):
+        """Wait until `amount` is available (for 0: until the bucket is out of debt), then remove it."""
+        async with self._lock:
+            self._refill()
+            need = min(amount, self.capacity)
+            if self.level < need:
+                await asyncio.sleep((need - self.level) / self.rate)
+                self._refill()
+            self.level -= amount
+
+    def spend(self, amount: float):
+        """Charge usage that is only known afterwards (tokens); the bucket may go into debt."""
+        self._refill()
+        self.level -= amount
+
+class AsyncAgent:
+    """Runs many tasks concurrently in one event loop on one AsyncAnthropic client (one connection pool).
+
+    Each task gets its own Agent for its conversation, tool cache and Python worker. Model calls
+    share request- and token-per-minute buckets, and blocking tools run on one shared thread pool.
+    """
+
+    def __init__(self, api_key: str = None, concurrency: int = 16, rpm: float = 50, tpm: float = 40000,
+                 tool_threads: int = 32):
+        self.client = AsyncAnthropic(api_key=api_key or os.getenv("ANTHROPIC_API_KEY"))
+        self.requests, self.tokens = TokenBucket(rpm), TokenBucket(tpm)  # tpm counts input + output tokens
+        self.slots = asyncio.Semaphore(concurrency)
+        self.pool = ThreadPoolExecutor(max_workers=tool_threads)
+        self.indexes, self._index_lock = {}, threading.Lock()  # code indexes are shared by every task
+
+    async def run(self, task: str, max_iterations: int = 10) -> str:
+        async with self.slots:
+            agent = Agent(client=self.client)
+            agent.indexes, agent._index_lock = self.indexes, self._index_lock
+            try: return await self._run(agent, task, max_iterations)
+            finally: agent.worker.stop()
+
+    async def run_many(self, tasks: Iterable[str], max_iterations: int = 10) -> AsyncIterator[Tuple[str, str]]:
+        """Yield (task, result) pairs as tasks finish; a failed task yields its error as the result."""
+        async def one(task):
+            try: return task, await self.run(task, max_iterations)
+            except Exception as e: return task, f"Error: {e}"
+        for done in asyncio.as_completed([one(task) for task in tasks]):
+            yield await done
+
+    async def _run(self, agent: Agent, task: str, max_iterations: int) -> str:
+        agent.conversation = [{"role": "user", "content": f"Task: {task}\n\nComplete this task using available tools. Be concise and efficient."}]
         for i in range(max_iterations):
-            response = self.client.messages.create(model="claude-3-5-sonnet-20241022", max_tokens=4096,
-                                                   tools=self.tools, messages=self.conversation)
+            agent.tracer.iteration = i + 1
+            response, calls = await self._turn(agent)
 
-            self.conversation.append({"role": "assistant", "content": response.content})
+            agent.conversation.append({"role": "assistant", "content": response.content})
+            if context_tokens(response.usage) > COMPACT_AT:
+                agent.compact()
 
             if response.stop_reason == "end_turn":
-                result = next((block.text for block in response.content if hasattr(block, "text")), "Task completed")
-                print(f"\n✓ Agent completed task in {i+1} iterations")
-                return result
+                return next((block.text for block in response.content if hasattr(block, "text")), "Task completed")
 
             if response.stop_reason == "tool_use":
-                tool_results = []
-                for block in response.content:
-                    if block.type == "tool_use":
-                        print(f"→ Using tool: {block.name}")
-                        result = self.call_tool(block.name, block.input)
-                        print(f"  Result: {result[:100]}{'...' if len(result) > 100 else ''}")
-                        tool_results.append({"type": "tool_result", "tool_use_id": block.id, "content": result})
-
-                self.conversation.append({"role": "user", "content": tool_results})
+                results = await asyncio.gather(*(future for _, future in calls))
+                agent.conversation.append({"role": "user", "content": [
+                    {"type": "tool_result", "tool_use_id": block.id, "content": result}
+                    for (block, _), result in zip(calls, results)]})
 
         return "⚠ Max iterations reached"
 
+    async def _turn(self, agent: Agent) -> tuple:
+        """Agent.stream_turn without console output, paced by the shared rate limits."""
+        await self.tokens.take(0)
+        await self.requests.take(1)
+        calls, earlier, start, first = [], [], time.perf_counter(), None
+        async with self.client.messages.stream(model=MODEL, max_tokens=4096, tools=agent.tools,
+                                               messages=agent.messages()) as stream:
+            async for event in stream:
+                first = first or time.perf_counter()
+                if event.type == "content_block_stop" and event.content_block.type == "tool_use":
+                    block = event.content_block
+                    future = agent.dispatch(self.pool, earlier, block.name, block.input)
+                    calls.append((block, asyncio.wrap_future(future)))
+            response = await stream.get_final_message()
+        self.tokens.spend(response.usage.input_tokens + response.usage.output_tokens)
+        agent.trace_turn(response, len(calls), start, first)
+        return response, calls
+
+def option(args: list, name: str, default=None):
+    """Remove `name value` from args and return value."""
+    if name not in args[:-1]:
+        return default
+    i = args.index(name)
+    value = args[i + 1]
+    del args[i:i + 2]
+    return value
+
+async def run_batch(path: str, concurrency: int, rpm: float):
+    """Run every line of path as a task, printing one JSON result per line as tasks finish."""
+    tasks = [line.strip() for line in open(path) if line.strip()]
+    agent = AsyncAgent(concurrency=concurrency, rpm=rpm)
+    async for task, result in agent.run_many(tasks):
+        print(json.dumps({"task": task, "result": result}), flush=True)
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python agent.py \"<your task>\"")
+    args = sys.argv[1:]
+    trace, tasks = option(args, "--trace"), option(args, "--tasks")
+    concurrency, rpm = int(option(args, "--concurrency", 16)), float(option(args, "--rpm", 50))
+    if tasks:
+        asyncio.run(run_batch(tasks, concurrency, rpm))
+        return
+    if not args:
+        print("Usage: python agent.py \"<your task>\" [--trace run.json|run.jsonl]")
+        print("       python agent.py --tasks tasks.txt [--concurrency 16] [--rpm 50]")
         print("\nExamples:")
         print('  python agent.py "find all Python files in current dir"')
         print('  python agent.py "create a hello.txt file with greeting"')
-        print('  python agent.py "count lines of code in all .py files"')
+        print('  python agent.py "count lines of code in all .py files" --trace run.json')
         sys.exit(1)
 
     agent = Agent()
-    print(f"🤖 Agent starting task: {sys.argv[1]}\n")
-    result = agent.run(sys.argv[1])
+    print(f"🤖 Agent starting task: {args[0]}\n")
+    result = agent.run(args[0])
     print(f"\n📊 Final Result:\n{result}")
+    if trace:
+        agent.tracer.export(trace)
+        print(f"\n⏱ Trace written to {trace}\n{agent.tracer.summary()}")
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,33 @@
 #!/usr/bin/env python3
-"""Minimal MCP Server - Model Context Protocol implementation in <100 lines."""
-import json, sys
+"""Minimal MCP Server - Model Context Protocol implementation in one file."""
+import os, json, sys
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime
 from typing import Any, Dict, List
 
+class FileCache:
+    """LRU cache of file contents bounded by total size; an entry is reused only while mtime and size match."""
+
+    def __init__(self, max_bytes: int = 64 << 20):
+        self.max_bytes, self.size = max_bytes, 0
+        self.entries: OrderedDict = OrderedDict()  # path -> (mtime_ns, size, text)
+
+    def read(self, path: str) -> str:
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            self.entries.move_to_end(path)
+            return entry[2]
+        text = Path(path).read_text()
+        self.size -= entry[1] if entry else 0
+        self.entries[path] = (stat.st_mtime_ns, stat.st_size, text)
+        self.entries.move_to_end(path)
+        self.size += stat.st_size
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            self.size -= self.entries.popitem(last=False)[1][1]
+        return text
+
 class MCPServer:
     """Minimal MCP server implementing core protocol features."""
 
@@ -12,11 +35,16 @@ class MCPServer:
         self.name, self.version = name, version
         self.resources: Dict[str, Any] = {}
         self.tools: Dict[str, callable] = {}
+        self.files = FileCache()
 
     def register_resource(self, uri: str, content: str, mime_type: str = "text/plain"):
         """Register a resource that can be accessed by AI."""
         self.resources[uri] = {"uri": uri, "mimeType": mime_type, "text": content}
 
+    def register_file(self, uri: str, path: str, mime_type: str = "text/plain"):
+        """Register a file resource by path; its content is read (and cached) when first requested."""
+        self.resources[uri] = {"uri": uri, "mimeType": mime_type, "path": path}
+
     def register_tool(self, name: str, description: str, func: callable, schema: Dict = None):
         """Register a tool that can be called by AI."""
         self.tools[name] = {"name": name, "description": description, "func": func,
@@ -36,7 +64,13 @@ class MCPServer:
 
         elif method == "resources/read":
             uri = request.get("params", {}).get("uri")
-            return {"contents": [self.resources[uri]]} if uri in self.resources else {"error": "Resource not found"}
+            if uri not in self.resources:
+                return {"error": "Resource not found"}
+            resource = self.resources[uri]
+            if "path" in resource:
+                try: resource = {"uri": uri, "mimeType": resource["mimeType"], "text": self.files.read(resource["path"])}
+                except (OSError, UnicodeDecodeError) as e: return {"error": f"Cannot read resource: {e}"}
+            return {"contents": [resource]}
 
         elif method == "tools/list":
             return {"tools": [{k: v for k, v in t.items() if k != "func"} for t in self.tools.values()]}
@@ -73,14 +107,14 @@ def create_filesystem_server(root_path: str = "."):
     server = MCPServer(name="filesystem-mcp", version="1.0.0")
     root = Path(root_path)
 
-    # Register all text files as resources
-    for file_path in root.rglob("*.txt"):
-        try: server.register_resource(f"file://{file_path}", file_path.read_text(), "text/plain")
-        except: pass
-
-    for file_path in root.rglob("*.md"):
-        try: server.register_resource(f"file://{file_path}", file_path.read_text(), "text/markdown")
-        except: pass
+    # Register all text files as resources, by path only: one walk, no reads until resources/read
+    mime_types = {".txt": "text/plain", ".md": "text/markdown"}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            mime_type = mime_types.get(os.path.splitext(filename)[1])
+            if mime_type:
+                file_path = Path(dirpath) / filename
+                server.register_file(f"file://{file_path}", str(file_path), mime_type)
 
     # Register tools
     server.register_tool("get_file_info", "Get file metadata", lambda path: {
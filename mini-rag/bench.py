@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Mini RAG benchmark - index/save/load/search timings on synthetic or real corpora, as comparable JSON."""
+import io, os, sys, json, time, shutil, argparse, platform, subprocess, contextlib, tempfile, resource
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+from rag import MiniRAG, SEARCH_MODES, tokenize
+
+WORDS_PER_CHUNK = 64  # synthetic paragraphs are sized to one chunk each (chunker set to match)
+CHUNKS_PER_FILE = 100
+TOPICS = 256          # each file draws most of its words from one topic, so ANN lists are meaningful
+NOISE_FLOOR = {"_s": 0.01, "_ms": 0.5, "_mb": 1.0}  # smaller absolute changes are never regressions
+
+class StubClient:
+    """Stands in for Anthropic(): streams a fixed answer so query() runs without a network."""
+
+    class messages:
+        @staticmethod
+        @contextlib.contextmanager
+        def stream(**kwargs):
+            yield type("Stream", (), {"text_stream": iter(["Based on Document 1, ", "the answer is 42."])})()
+
+def generate_corpus(root: Path, chunks: int, seed: int = 0):
+    """Write `chunks` paragraphs (80% topic words, 20% Zipf-distributed noise) into CHUNKS_PER_FILE-paragraph files."""
+    rng = np.random.default_rng(seed)
+    vocab = np.array([f"w{i}" for i in range(50000)])
+    topics = rng.integers(len(vocab), size=(TOPICS, 400))
+    for start in range(0, chunks, CHUNKS_PER_FILE):
+        count = min(CHUNKS_PER_FILE, chunks - start)
+        topic = topics[rng.integers(TOPICS)]
+        words = np.where(rng.random((count, WORDS_PER_CHUNK)) < 0.8,
+                         topic[rng.integers(len(topic), size=(count, WORDS_PER_CHUNK))],
+                         rng.zipf(1.3, size=(count, WORDS_PER_CHUNK)) % len(vocab))
+        path = root / f"d{start // 100000:02d}" / f"f{start:07d}.txt"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("\n\n".join(" ".join(row) for row in vocab[words]) + "\n")
+
+def reset_peak_rss():
+    """Restart the peak-RSS high-water mark (Linux only; elsewhere peaks are process-wide)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmHWM")) / 1024
+    except (OSError, StopIteration):
+        scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+def disk_mb(path: Path) -> float:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file()) / 1e6
+
+def percentiles(ms: List[float]) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+def stage(fn):
+    """Run fn with its progress output silenced; returns (result, seconds, peak RSS MB)."""
+    reset_peak_rss()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = fn()
+    return result, time.perf_counter() - start, peak_rss_mb()
+
+def run(corpus: Path, kb: Path, queries: int, workers: int, ann: bool) -> dict:
+    """Benchmark one corpus: index, save, load, per-mode search latency, batched search and query."""
+    rag = MiniRAG()
+    rag.client, rag.chunk_tokens, rag.chunk_overlap = StubClient(), WORDS_PER_CHUNK, 0
+    _, index_s, index_rss = stage(lambda: rag.add_directory(str(corpus), [".txt", ".md"], workers))
+    _, save_s, _ = stage(lambda: rag.save(str(kb)))
+    rag = MiniRAG()
+    rag.client = StubClient()
+    _, load_s, load_rss = stage(lambda: rag.load(str(kb)))
+    result = {"chunks": rag.count, "files": len(rag.manifest), "corpus_bytes": int(disk_mb(corpus) * 1e6),
+              "index_s": index_s, "index_chunks_per_sec": rag.count / index_s, "index_peak_rss_mb": index_rss,
+              "save_s": save_s, "disk_mb": disk_mb(kb), "load_s": load_s, "load_peak_rss_mb": load_rss}
+
+    rng = np.random.default_rng(1)  # queries: a few words drawn from random stored chunks
+    texts = [tokenize(rag.documents[int(i)]["content"]) for i in rng.integers(rag.count, size=queries)]
+    questions = [" ".join(rng.choice(words, min(6, len(words)), replace=False)) for words in texts if words]
+    def latencies(search) -> Dict[str, float]:
+        search(questions[0])  # warm-up: memory maps, lazy postings
+        ms = []
+        for q in questions:
+            start = time.perf_counter()
+            search(q)
+            ms.append((time.perf_counter() - start) * 1000)
+        return percentiles(ms)
+
+    reset_peak_rss()
+    result["search"] = {mode: latencies(lambda q: rag.search(q, 10, mode)) for mode in SEARCH_MODES}
+    _, batch_s, _ = stage(lambda: rag.search_batch(questions, 10))
+    result["search_batch_ms_per_query"] = batch_s * 1000 / len(questions)
+    result["query"] = latencies(lambda q: rag.query(q))
+    result["search_peak_rss_mb"] = peak_rss_mb()
+    if ann:
+        _, result["ann_build_s"], _ = stage(lambda: rag.build_ann())
+        result["search"]["ann"] = latencies(lambda q: rag.search(q, 10))
+    return result
+
+def flatten(data: dict, prefix: str = "") -> Dict[str, float]:
+    out = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            out.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            out[f"{prefix}{key}"] = value
+    return out
+
+def compare(baseline: dict, current: dict, tolerance: float) -> List[str]:
+    """Print per-metric changes; returns the metrics that got slower/bigger by more than `tolerance`."""
+    old = {r["chunks"]: flatten(r) for r in baseline["results"]}
+    regressions = []
+    print(f"\nvs {baseline.get('commit', '?')[:10]} (tolerance {tolerance:.0%}):")
+    for result in current["results"]:
+        if result["chunks"] not in old:
+            continue
+        for metric, value in flatten(result).items():
+            before = old[result["chunks"]].get(metric)
+            unit = next((u for u in NOISE_FLOOR if metric.endswith(u)), None)  # lower is better for these
+            if not before or unit is None:
+                continue
+            change = value / before - 1
+            flag = "  ✗ REGRESSION" if change > tolerance and value - before > NOISE_FLOOR[unit] else ""
+            print(f"  {result['chunks']:>8} {metric:<32} {before:>10.2f} → {value:>10.2f} ({change:+.0%}){flag}")
+            if flag:
+                regressions.append(f"{result['chunks']}:{metric}")
+    return regressions
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit": commit, "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "machine": platform.machine(), "cpus": os.cpu_count()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Mini RAG indexing and retrieval",
+                                     epilog="example: python bench.py --sizes 1000,100000 --out before.json")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="Synthetic corpus sizes in chunks, comma-separated (up to 1000000)")
+    parser.add_argument("--corpus", help="Benchmark this directory instead of synthetic corpora")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per latency measurement")
+    parser.add_argument("--workers", type=int, help="Indexing processes (default: all cores)")
+    parser.add_argument("--ann", action="store_true", help="Also build and time the IVF index")
+    parser.add_argument("--out", default="bench.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Earlier results to compare against (exit 1 on regressions)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging, e.g. 0.2")
+    args = parser.parse_args()
+
+    report = {**environment(), "config": {"queries": args.queries, "workers": args.workers, "ann": args.ann,
+                                          "words_per_chunk": WORDS_PER_CHUNK}, "results": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        corpora = [(Path(args.corpus), None)] if args.corpus else [(Path(tmp) / f"corpus-{n}", int(n))
+                                                                   for n in args.sizes.split(",")]
+        for corpus, size in corpora:
+            if size:
+                print(f"Generating {size} chunks...", flush=True)
+                generate_corpus(corpus, size)
+            result = run(corpus, Path(tmp) / f"kb-{corpus.name}", args.queries, args.workers, args.ann)
+            report["results"].append(result)
+            search = result["search"]["dense"]
+            print(f"{result['chunks']:>8} chunks: index {result['index_s']:.1f}s ({result['index_chunks_per_sec']:.0f}/s), "
+                  f"load {result['load_s'] * 1000:.0f}ms, dense p50/p99 {search['p50_ms']:.2f}/{search['p99_ms']:.2f}ms, "
+                  f"disk {result['disk_mb']:.1f}MB, peak RSS {result['index_peak_rss_mb']:.0f}MB")
+            if size:
+                shutil.rmtree(corpus)
+    Path(args.out).write_text(json.dumps(report, indent=2))
+    print(f"✓ Results written to {args.out}")
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), report, args.tolerance)
+        if regressions:
+            sys.exit(f"\n✗ {len(regressions)} regressions: {', '.join(regressions)}")
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,1225 @@
 #!/usr/bin/env python3
-"""Minimal RAG - Chat with your documents in <100 lines."""
-import os, sys, json
+"""Minimal RAG - Chat with your documents, no vector DB needed."""
+import io, os, re, sys, json, time, heapq, shutil, signal, hashlib, argparse, threading
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
 from pathlib import Path
-from typing import List, Tuple
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+from zlib import adler32, crc32
 import numpy as np
 from anthropic import Anthropic
 
+TOKEN = re.compile(r"\w+")
+EMBED_DIM = 1024      # hashed feature buckets; same word -> same dimension in every vector
+EMBED_BATCH = 4096    # chunks embedded per NumPy pass
+KB_FORMAT = 1         # header.json + embeddings.npy (memory-mapped) + chunks.jsonl/offsets.npy
+COMPACT_RATIO = 0.25  # compact on save once this fraction of rows is tombstoned
+RRF_K = 60            # reciprocal rank fusion constant for hybrid search
+SEARCH_MODES = ("dense", "bm25", "hybrid")
+ANN_PROBES = 8        # default IVF lists scanned per query
+CHUNK_TOKENS = 200    # chunk budget in word tokens
+CHUNK_OVERLAP = 40    # tokens repeated from the end of the previous chunk
+STREAM_BYTES = 16 << 20  # larger files are chunked straight from disk and their text loaded lazily
+QUANT_KINDS = ("float16", "int8")
+QUANT_BLOCK = 16384   # quantized rows widened to float32 per scoring step
+RESCORE = 4           # quantized candidates per result that are rescored exactly
+CHUNK_CACHE = 4096    # chunk records kept in memory per index (least recently used are dropped)
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens shared by the vectorizer and the keyword index."""
+    return TOKEN.findall(text.lower())
+
+Postings = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]  # rows, term keys, tfs, doc lengths
+_TERM_KEYS: Dict[str, int] = {}
+
+def term_key(word: str) -> int:
+    """Stable 64-bit term id: crc32 (also the embedding bucket) in the high half, adler32 in the low."""
+    if len(_TERM_KEYS) > 1 << 21:
+        _TERM_KEYS.clear()
+    data = word.encode()
+    key = _TERM_KEYS[word] = (crc32(data) << 32) | adler32(data)
+    return key
+
+def term_keys(tokens: List[str]) -> np.ndarray:
+    return np.array([_TERM_KEYS.get(w) or term_key(w) for w in tokens], dtype=np.uint64)
+
+def analyze(texts: List[str], dim: int = EMBED_DIM) -> Tuple[np.ndarray, Postings]:
+    """Tokenize once; return hashed embeddings plus per-chunk term postings for the keyword index."""
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    parts = [(np.zeros(0, np.int64), np.zeros(0, np.uint64), np.zeros(0, np.int64), np.zeros(0, np.int64))]
+    for start in range(0, len(texts), EMBED_BATCH):
+        tokens = [tokenize(t) for t in texts[start:start + EMBED_BATCH]]
+        lengths = np.fromiter(map(len, tokens), np.int64, len(tokens))
+        keys = term_keys([w for ws in tokens for w in ws])
+        rows = np.repeat(np.arange(len(tokens)), lengths)
+        buckets = ((keys >> np.uint64(32)) % np.uint64(dim)).astype(np.int64)
+        counts = np.bincount(rows * dim + buckets, minlength=len(tokens) * dim).reshape(len(tokens), dim)
+        out[start:start + len(tokens)] = np.log1p(counts)
+        order = np.lexsort((keys, rows))
+        rows, keys = rows[order], keys[order]
+        first = np.flatnonzero(np.r_[True, (rows[1:] != rows[:-1]) | (keys[1:] != keys[:-1])])
+        parts.append((rows[first] + start, keys[first], np.diff(np.r_[first, len(rows)]), lengths))
+    rows, keys, tfs, lengths = (np.concatenate(p) for p in zip(*parts))
+    postings = (rows.astype(np.uint32), keys, np.minimum(tfs, 65535).astype(np.uint16), lengths.astype(np.uint32))
+    return out / (np.linalg.norm(out, axis=1, keepdims=True) + 1e-10), postings
+
+def hash_embed(texts: List[str], dim: int = EMBED_DIM) -> np.ndarray:
+    """Embed texts as L2-normalized, log-scaled hashed term frequencies (no API needed)."""
+    return analyze(texts, dim)[0]
+
+def top_k_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Best k column indices per row of a (queries, docs) score matrix, best first."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.zeros((len(scores), 0), np.int64), np.zeros((len(scores), 0), scores.dtype)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1)
+    idx = np.take_along_axis(part, order, axis=1)
+    return idx, np.take_along_axis(scores, idx, axis=1)
+
+def rrf_fuse(rankings: List[np.ndarray], top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Reciprocal rank fusion of best-first row lists; returns (rows, fused scores), best first."""
+    rrf: Dict[int, float] = {}
+    for ranked in rankings:
+        for rank, row in enumerate(ranked.tolist()):
+            rrf[row] = rrf.get(row, 0.0) + 1 / (RRF_K + rank + 1)
+    best = sorted(rrf, key=rrf.get, reverse=True)[:top_k]
+    return np.array(best, dtype=np.int64), np.array([rrf[r] for r in best], dtype=np.float32)
+
+def quantize(vectors: np.ndarray, kind: str) -> Tuple[np.ndarray, np.ndarray]:
+    """float16 copy, or int8 rows with a per-row scale (row ~ q * scale); scale is None for float16."""
+    if kind == "float16":
+        return vectors.astype(np.float16), None
+    scale = np.abs(vectors).max(axis=1) / 127
+    scale[scale == 0] = 1
+    return np.round(vectors / scale[:, None]).astype(np.int8), scale.astype(np.float32)
+
+def walk_files(dirpath: str, extensions: List[str]) -> Iterator[Tuple[Path, os.stat_result]]:
+    """Single directory walk yielding (path, stat) for files with a matching extension."""
+    stack = [dirpath]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file() and os.path.splitext(entry.name)[1] in extensions:
+                yield Path(entry.path), entry.stat()
+
+def _lines(f: BinaryIO, max_tokens: int) -> Iterator[Tuple[str, int, int, int, bool]]:
+    """(text, start byte, end byte, tokens, starts a block) per line; lines over budget are split.
+
+    Text is decoded with surrogateescape so that invalid bytes, and characters split by the
+    64 KiB read limit, re-encode to their original length and byte offsets stay exact.
+    """
+    pos, blank = 0, True
+    for raw in iter(lambda: f.readline(1 << 16), b""):
+        text = raw.decode("utf-8", errors="surrogateescape")
+        words = [m.start() for m in TOKEN.finditer(text)]
+        boundary, blank = blank or text.startswith("#"), not text.strip()
+        cuts = [0] + words[max_tokens::max_tokens] + [len(text)]
+        for i, (a, b) in enumerate(zip(cuts, cuts[1:])):
+            start = pos + _nbytes(text[:a])
+            yield text[a:b], start, start + _nbytes(text[a:b]), min(max_tokens, len(words) - i * max_tokens), boundary and i == 0
+        pos += len(raw)
+
+def _nbytes(text: str) -> int:
+    return len(text.encode("utf-8", errors="surrogateescape"))
+
+def _joined(lines: list) -> str:
+    """Chunk text from _lines() entries, decoded the way chunk_text() reads it back from the file."""
+    return "".join(l[0] for l in lines).encode("utf-8", errors="surrogateescape").decode("utf-8", errors="replace")
+
+def iter_chunks(f: BinaryIO, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP) -> Iterator[Tuple[str, int, int]]:
+    """Stream (text, start byte, end byte) chunks of at most max_tokens word tokens from a binary file.
+
+    Chunks break preferably at paragraph or heading boundaries and start with up to `overlap`
+    tokens of the previous chunk. Only the lines of the chunk being built are held in memory.
+    """
+    chunk, tokens, fresh = [], 0, 0  # fresh: index of the first line not carried over as overlap
+    for line in _lines(f, max_tokens):
+        while chunk and tokens + line[3] > max_tokens:
+            before = np.cumsum([0] + [l[3] for l in chunk])
+            cuts = [i for i in range(fresh + 1, len(chunk)) if chunk[i][4] and before[i] >= max_tokens // 2]
+            cut = cuts[-1] if cuts else len(chunk)
+            head, rest, tail, carried = chunk[:cut], chunk[cut:], [], 0
+            if cut > fresh and before[cut]:
+                yield _joined(head), head[0][1], head[-1][2]
+            for l in reversed(head[fresh:]):
+                if carried + l[3] > overlap:  # carry only the last tokens of this line
+                    words = [m.start() for m in TOKEN.finditer(l[0])][l[3] - (overlap - carried):]
+                    if words:
+                        start = l[1] + _nbytes(l[0][:words[0]])
+                        tail.insert(0, (l[0][words[0]:], start, l[2], len(words), False))
+                        carried += len(words)
+                    break
+                tail.insert(0, l)
+                carried += l[3]
+            if carried + before[-1] - before[cut] + line[3] > max_tokens:
+                tail = []
+            chunk, fresh = tail + rest, len(tail)
+            tokens = sum(l[3] for l in chunk)
+        chunk.append(line)
+        tokens += line[3]
+    if len(chunk) > fresh and tokens:
+        yield _joined(chunk), chunk[0][1], chunk[-1][2]
+
+def chunk_text(record: dict) -> str:
+    """Chunk text, read from its source byte range if it was indexed lazily."""
+    if "content" in record:
+        return record["content"]
+    start, end = record["metadata"]["offset"]
+    with open(record["metadata"]["source"], "rb") as f:
+        f.seek(start)
+        return f.read(end - start).decode("utf-8", errors="replace")
+
+def _read_hashed(path: Path) -> Tuple[bytes, str]:
+    """Pipeline stage run on the I/O thread pool; large files are hashed in blocks and not kept."""
+    if path.stat().st_size <= STREAM_BYTES:
+        data = path.read_bytes()
+        return data, hashlib.sha256(data).hexdigest()
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return None, digest.hexdigest()
+
+def _chunk_and_embed(data: bytes, dim: int, max_tokens: int, overlap: int) -> tuple:
+    """Pipeline stage run on the process pool (module-level so it can be pickled)."""
+    chunks = list(iter_chunks(io.BytesIO(data), max_tokens, overlap))
+    texts = [text for text, _, _ in chunks]
+    return (texts, [[start, end] for _, start, end in chunks]) + analyze(texts, dim)
+
+def _write_atomic(path: Path, write):
+    """Write via a temp file and rename, so readers never see a half-written file."""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+def _save_rows(path: Path, array: np.ndarray, saved: int = 0):
+    """np.save, except that when the file already holds the first `saved` rows of array, only the
+    rest is appended and the shape in the header is patched in place (np.save leaves room for that)."""
+    array = np.asarray(array)
+    if saved and path.exists():
+        with open(path, "r+b") as f:
+            version = np.lib.format.read_magic(f)
+            start = f.tell()
+            read_header = {(1, 0): np.lib.format.read_array_header_1_0, (2, 0): np.lib.format.read_array_header_2_0}
+            shape, fortran, dtype = read_header[version](f) if version in read_header else ((-1,), True, None)
+            data = f.tell()
+            header = repr({"descr": np.lib.format.dtype_to_descr(array.dtype), "fortran_order": False,
+                           "shape": array.shape}).replace("}", ", }").encode("latin1")
+            size = data - start - (2 if version == (1, 0) else 4)
+            if (shape[0] == saved and shape[1:] == array.shape[1:] and dtype == array.dtype and not fortran
+                    and len(header) < size and f.seek(0, 2) == data + saved * array[:1].nbytes):
+                f.write(np.ascontiguousarray(array[saved:]).tobytes())
+                f.seek(data - size)
+                f.write(header.ljust(size - 1) + b"\n")
+                return
+    _write_atomic(path, lambda f: np.save(f, array))
+
+class ChunkStore:
+    """Chunk records held in memory or read lazily from an offset-indexed JSONL file."""
+
+    def __init__(self, path: Path = None, offsets: np.ndarray = None):
+        self.path = path
+        self.offsets = offsets if offsets is not None else np.zeros(0, dtype=np.int64)
+        self.new: List[dict] = []   # appended since the file was written
+        self.rewrite = False        # set by select(): the file holds dropped rows
+        self._cache: OrderedDict = OrderedDict()  # row -> record, at most CHUNK_CACHE
+        self._lock = threading.Lock()
+        # held open so that offsets keep pointing into this file after a compaction replaces it on disk
+        self._file = open(path, "rb") if path is not None and len(self.offsets) else None
+
+    def __len__(self) -> int:
+        return len(self.offsets) + len(self.new)
+
+    def __getitem__(self, i: int) -> dict:
+        i = int(i) + len(self) if i < 0 else int(i)
+        if i >= len(self.offsets):
+            record = self.new[i - len(self.offsets)]
+            return record if "content" in record else dict(record, content=chunk_text(record))
+        with self._lock:
+            record = self._cache.get(i)
+            if record is not None:
+                self._cache.move_to_end(i)
+                return record
+            self._file.seek(int(self.offsets[i]))
+            line = self._file.readline()
+        record = json.loads(line)
+        record = dict(record, content=chunk_text(record))
+        with self._lock:
+            self._cache[i] = record
+            if len(self._cache) > CHUNK_CACHE:
+                self._cache.popitem(last=False)
+        return record
+
+    def __iter__(self) -> Iterator[dict]:
+        for offset in self.offsets:
+            with self._lock:  # the file position is shared with concurrent lookups
+                self._file.seek(int(offset))
+                line = self._file.readline()
+            yield json.loads(line)
+        yield from self.new
+
+    def extend(self, records):
+        self.new.extend(records)
+
+    def select(self, rows: np.ndarray) -> "ChunkStore":
+        """Store holding only `rows` (sorted); the next save rewrites the file without the rest."""
+        on_disk = rows[rows < len(self.offsets)]
+        store = ChunkStore(self.path)
+        store.offsets, store._file = np.asarray(self.offsets)[on_disk], self._file
+        store.new = [self.new[i - len(self.offsets)] for i in rows[len(on_disk):]]
+        store.rewrite = True
+        return store
+
+    @classmethod
+    def open(cls, path: Path, offsets_path: Path) -> "ChunkStore":
+        return cls(path, np.load(offsets_path, mmap_mode="r"))
+
+    def save(self, path: Path, offsets_path: Path):
+        """Append new records if this store already lives at `path`, otherwise write it out."""
+        if self.path is not None and not self.rewrite and Path(self.path).resolve() == path.resolve():
+            with open(path, "ab") as f:
+                pos, lines = f.tell(), [json.dumps(r).encode() + b"\n" for r in self.new]
+                f.writelines(lines)
+            start = np.cumsum([pos] + [len(l) for l in lines[:-1]]) if lines else np.zeros(0)
+            offsets = np.concatenate([self.offsets, np.asarray(start, dtype=np.int64)])
+            _save_rows(offsets_path, offsets, len(self.offsets))
+        else:
+            offsets = []
+            def write(f):
+                for record in self:
+                    offsets.append(f.tell())
+                    f.write(json.dumps(record).encode() + b"\n")
+            _write_atomic(path, write)
+            _save_rows(offsets_path, np.asarray(offsets, dtype=np.int64))
+        self.__init__(path, np.load(offsets_path, mmap_mode="r"))
+
+class BM25Index:
+    """Keyword index: CSR postings (sorted term keys -> doc ids, tfs) on disk plus an in-memory delta.
+
+    Each save appends the delta as a new segment (rows are append-only, so segments cover
+    consecutive row ranges). A segment at least half the size of the one before it is merged
+    into it, which keeps the segment count logarithmic and every save proportional to the change.
+    """
+    K1, B = 1.2, 0.75
+    FILES = ("keys", "ptr", "docs", "tfs", "lengths")
+
+    def __init__(self, path: Path = None):
+        self.path = path       # base segment's .npy files, later segments in seg1/, seg2/, ...
+        self._segments = None  # CSR dicts in row order; loaded (memory-mapped) on first use
+        self._saved = 0        # leading segments that are on disk at path as they are in memory
+        self._delta: List[Postings] = []
+
+    @property
+    def segments(self) -> List[Dict[str, np.ndarray]]:
+        if self._segments is None:
+            self._segments = []
+            if self.path is not None and (self.path / "keys.npy").exists():
+                dirs = [self.path] + sorted(self.path.glob("seg*"), key=lambda p: int(p.name[3:]))
+                self._segments = [{name: np.load(d / f"{name}.npy", mmap_mode="r") for name in self.FILES}
+                                  for d in dirs]
+                self._saved = len(self._segments)
+        if self._delta:
+            rows, keys, tfs, lengths = (np.concatenate(p) for p in zip(*self._delta))
+            self._delta = []
+            order = np.argsort(keys, kind="stable")  # delta rows are already ascending
+            self._segments.append(self._csr(keys[order], rows[order], tfs[order], lengths))
+            while len(self._segments) > 1 and 2 * len(self._segments[-1]["docs"]) >= len(self._segments[-2]["docs"]):
+                self._segments[-2:] = [self._merge(*self._segments[-2:])]
+                self._saved = min(self._saved, len(self._segments) - 1)
+        return self._segments
+
+    @property
+    def csr(self) -> Dict[str, np.ndarray]:
+        """All segments merged into one."""
+        segments = self.segments
+        if not segments:
+            return self._csr(np.zeros(0, np.uint64), np.zeros(0, np.uint32), np.zeros(0, np.uint16), np.zeros(0, np.uint32))
+        while len(segments) > 1:
+            segments[-2:] = [self._merge(*segments[-2:])]
+            self._saved = min(self._saved, len(segments) - 1)
+        return segments[0]
+
+    def add(self, first_row: int, postings: Postings):
+        rows, keys, tfs, lengths = postings
+        self._delta.append((rows + np.uint32(first_row), keys, tfs, lengths))
+
+    def _merge(self, old: Dict[str, np.ndarray], new: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """Fold a newer segment into an older one in linear time (its rows all come after old's)."""
+        old_keys = np.repeat(old["keys"], np.diff(old["ptr"]))
+        new_keys = np.repeat(new["keys"], np.diff(new["ptr"]))
+        at = np.searchsorted(old_keys, new_keys, side="right")
+        return self._csr(np.insert(old_keys, at, new_keys), np.insert(old["docs"], at, new["docs"]),
+                         np.insert(old["tfs"], at, new["tfs"]), np.concatenate([old["lengths"], new["lengths"]]))
+
+    @staticmethod
+    def _csr(keys: np.ndarray, docs: np.ndarray, tfs: np.ndarray, lengths: np.ndarray) -> Dict[str, np.ndarray]:
+        """CSR arrays from key-sorted postings."""
+        first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, np.int64)
+        return {"keys": keys[first], "ptr": np.r_[first, len(keys)].astype(np.int64), "docs": docs,
+                "tfs": tfs, "lengths": lengths}
+
+    def compact(self, keep: np.ndarray):
+        """Drop postings of removed rows and renumber the rest (keep is a boolean row mask)."""
+        csr, new_row = self.csr, np.cumsum(keep) - 1
+        live = keep[csr["docs"]]
+        keys = np.repeat(csr["keys"], np.diff(csr["ptr"]))[live]
+        self._segments, self._saved = [self._csr(keys, new_row[csr["docs"][live]].astype(np.uint32),
+                                                 np.asarray(csr["tfs"])[live], np.asarray(csr["lengths"])[keep])], 0
+
+    def _postings(self, key) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(rows, term frequencies, row lengths) of one term key across all segments."""
+        docs, tfs, lengths, first = [], [], [], 0
+        for s in self.segments:
+            i = int(np.searchsorted(s["keys"], key))
+            if i < len(s["keys"]) and s["keys"][i] == key:
+                d = s["docs"][s["ptr"][i]:s["ptr"][i + 1]]
+                docs.append(d)
+                tfs.append(s["tfs"][s["ptr"][i]:s["ptr"][i + 1]])
+                lengths.append(s["lengths"][d - first])
+            first += len(s["lengths"])
+        if not docs:
+            return np.zeros(0, np.uint32), np.zeros(0, np.float32), np.zeros(0, np.float32)
+        return np.concatenate(docs), np.concatenate(tfs).astype(np.float32), np.concatenate(lengths).astype(np.float32)
+
+    def _totals(self) -> Tuple[int, float]:
+        return (sum(len(s["lengths"]) for s in self.segments),
+                float(sum(s["lengths"].sum() for s in self.segments)))
+
+    def term_stats(self, query: str) -> Tuple[int, float, Dict[int, int]]:
+        """(documents, summed length, document frequency per query term): summed over several
+        indexes and passed back to search(), they give every index the same IDF and avgdl."""
+        dfs = {int(key): len(self._postings(key)[0]) for key in np.unique(term_keys(tokenize(query)))}
+        return (*self._totals(), dfs)
+
+    def search(self, query: str, dead: np.ndarray, top_k: int,
+               stats: Tuple[int, float, Dict[int, int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25 over the postings of the query terms only; returns (rows, scores), best first.
+
+        stats (see term_stats) replaces this index's own document count, lengths and frequencies.
+        """
+        n, total, dfs = stats or (*self._totals(), {})
+        avgdl = total / n if n else 1.0
+        docs, weights = [], []
+        for key in np.unique(term_keys(tokenize(query))):
+            d, tf, dl = self._postings(key)
+            if not len(d):
+                continue
+            df = dfs.get(int(key), len(d))
+            idf = np.log(1 + (n - df + 0.5) / (df + 0.5))
+            docs.append(d)
+            weights.append(idf * tf * (self.K1 + 1) / (tf + self.K1 * (1 - self.B + self.B * dl / avgdl)))
+        if not docs:
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        rows, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights))
+        keep = ~dead[rows]  # tombstoned and filtered-out rows are never returned
+        rows, scores = rows[keep], scores[keep]
+        idx, top = top_k_rows(scores[None, :], top_k)
+        return rows[idx[0]], top[0]
+
+    def save(self, path: Path):
+        """Write the segments added since the last save; a new path or a compacted index is written whole."""
+        path.mkdir(parents=True, exist_ok=True)
+        segments = self.segments  # loads what is on disk, then adds the delta
+        if self.path is None or Path(self.path).resolve() != path.resolve():
+            self._saved = 0
+        if not self._saved:
+            segments = [self.csr]
+        for i in range(self._saved, len(segments)):
+            target = path if i == 0 else path / f"seg{i}"
+            target.mkdir(exist_ok=True)
+            for name in self.FILES:
+                _write_atomic(target / f"{name}.npy", lambda f: np.save(f, segments[i][name]))
+        for stale in path.glob("seg*"):  # merged into an earlier segment
+            if int(stale.name[3:]) >= len(segments):
+                shutil.rmtree(stale)
+        self.path, self._saved = path, len(segments)
+
+def _timestamp(value) -> float:
+    """Unix time from an ISO date/datetime string or a number; nan when unknown."""
+    if value is None or value == "":
+        return float("nan")
+    return float(value) if isinstance(value, (int, float)) else datetime.fromisoformat(value).timestamp()
+
+class MetadataIndex:
+    """Filter columns: a source id and a date per row plus (row, tag) postings, saved as .npy files.
+
+    Each (field, value) filter becomes a boolean row mask that is kept until the index
+    changes, so a repeated filter costs one AND over the rows instead of a metadata scan.
+    """
+    FIELDS = ("prefix", "ext", "tags", "since", "until")
+
+    def __init__(self, path: Path = None):
+        self.sources: List[str] = []  # unique source paths; rows refer to them by position
+        self.tags: List[str] = []
+        self.source, self.date = np.zeros(0, np.int32), np.zeros(0, np.float64)
+        self.tag_rows, self.tag_ids = np.zeros(0, np.int64), np.zeros(0, np.int32)
+        self._source_ids, self._tag_ids = {}, {}
+        self._path = path if path is not None and (path / "names.json").exists() else None  # read on first use
+        self._delta: list = []
+        self._masks: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()  # serve: concurrent filtered searches share the columns and masks
+        self._saved = (path, {})  # directory and the column lengths last read from or written to it
+
+    def _open(self):
+        """Read the saved columns; deferred so that unfiltered searches never parse names.json."""
+        with self._lock:
+            if self._path is None:
+                return
+            names = json.loads((self._path / "names.json").read_text())
+            self.sources, self.tags = names["sources"], names["tags"]
+            self.source, self.date = np.load(self._path / "source.npy"), np.load(self._path / "date.npy")
+            self.tag_rows, self.tag_ids = np.load(self._path / "tag_rows.npy"), np.load(self._path / "tag_ids.npy")
+            self._source_ids = {s: i for i, s in enumerate(self.sources)}
+            self._tag_ids = {t: i for i, t in enumerate(self.tags)}
+            self._saved = (self._path, self._lengths())
+            self._path = None  # only once every column is in place
+
+    def _lengths(self) -> Dict[str, int]:
+        return {name: len(getattr(self, name)) for name in ("source", "date", "tag_rows", "tag_ids", "sources", "tags")}
+
+    def add(self, first_row: int, metadatas: List[dict]):
+        self._open()
+        source, date, tag_rows, tag_ids = [], [], [], []
+        for row, meta in enumerate(metadatas, first_row):
+            key = meta.get("source")
+            if key is not None and key not in self._source_ids:
+                self._source_ids[key] = len(self.sources)
+                self.sources.append(key)
+            source.append(-1 if key is None else self._source_ids[key])
+            date.append(_timestamp(meta.get("date")))
+            for tag in meta.get("tags", ()):
+                if tag not in self._tag_ids:
+                    self._tag_ids[tag] = len(self.tags)
+                    self.tags.append(tag)
+                tag_rows.append(row)
+                tag_ids.append(self._tag_ids[tag])
+        self._delta.append((source, date, tag_rows, tag_ids))
+        self._masks.clear()
+
+    def _merge(self):
+        self._open()
+        if self._delta:
+            source, date, tag_rows, tag_ids = (sum(column, []) for column in zip(*self._delta))
+            self._delta = []
+            self.source = np.concatenate([self.source, np.array(source, dtype=np.int32)])
+            self.date = np.concatenate([self.date, np.array(date, dtype=np.float64)])
+            self.tag_rows = np.concatenate([self.tag_rows, np.array(tag_rows, dtype=np.int64)])
+            self.tag_ids = np.concatenate([self.tag_ids, np.array(tag_ids, dtype=np.int32)])
+
+    def mask(self, filters: dict, size: int) -> np.ndarray:
+        """Rows matching every filter: prefix (path), ext (one or a list), tags (all of), since/until (dates)."""
+        unknown = set(filters) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown filter {sorted(unknown)}, expected some of {self.FIELDS}")
+        mask = np.ones(size, dtype=bool)
+        with self._lock:
+            self._merge()
+            for field, value in sorted(filters.items()):
+                if value in (None, "", []):
+                    continue
+                key = json.dumps([field, value])
+                if key not in self._masks:
+                    self._masks[key] = self._field_mask(field, value)
+                    if len(self._masks) > 64:
+                        self._masks.popitem(last=False)
+                self._masks.move_to_end(key)
+                mask &= self._masks[key][:size]
+        return mask
+
+    def _field_mask(self, field: str, value) -> np.ndarray:
+        if field == "prefix":  # sources are absolute (older indexes: relative to the working directory)
+            parts = Path(value).resolve().parts
+            return np.isin(self.source, [i for i, s in enumerate(self.sources)
+                                         if Path(os.path.abspath(s)).parts[:len(parts)] == parts])
+        if field == "ext":
+            exts = {e if e.startswith(".") else f".{e}" for e in ([value] if isinstance(value, str) else value)}
+            return np.isin(self.source, [i for i, s in enumerate(self.sources) if Path(s).suffix in exts])
+        if field == "tags":
+            mask = np.ones(len(self.source), dtype=bool)
+            for tag in [value] if isinstance(value, str) else value:
+                tagged = np.zeros(len(self.source), dtype=bool)
+                tagged[self.tag_rows[self.tag_ids == self._tag_ids.get(tag, -1)]] = True
+                mask &= tagged
+            return mask
+        with np.errstate(invalid="ignore"):  # unknown (nan) dates never match
+            return self.date >= _timestamp(value) if field == "since" else self.date <= _timestamp(value)
+
+    def compact(self, keep: np.ndarray):
+        """Drop removed rows and renumber the rest (keep is a boolean row mask)."""
+        self._merge()
+        live = keep[self.tag_rows]
+        self.tag_rows, self.tag_ids = (np.cumsum(keep) - 1)[self.tag_rows[live]], self.tag_ids[live]
+        self.source, self.date = self.source[keep], self.date[keep]
+        self._masks.clear()
+        self._saved = (None, {})
+
+    def save(self, path: Path):
+        """Append rows added since the last save; columns of a new path or a compacted index are written whole."""
+        if self._path is not None and self._path == path:  # never opened, so unchanged
+            return
+        self._merge()
+        path.mkdir(parents=True, exist_ok=True)
+        saved = self._saved[1] if self._saved[0] is not None and Path(self._saved[0]).resolve() == path.resolve() else {}
+        for name in ("source", "date", "tag_rows", "tag_ids"):
+            _save_rows(path / f"{name}.npy", getattr(self, name), saved.get(name, 0))
+        if (saved.get("sources"), saved.get("tags")) != (len(self.sources), len(self.tags)):
+            _write_atomic(path / "names.json", lambda f: f.write(json.dumps({"sources": self.sources, "tags": self.tags}).encode()))
+        self._saved = (path, self._lengths())
+
+class IVFIndex:
+    """Approximate nearest neighbours: k-means centroids, each row filed under its nearest one."""
+
+    def __init__(self, centroids: np.ndarray, assign: np.ndarray):
+        self.centroids = centroids  # (lists, dim) float32, unit length
+        self.assign = assign        # list id per row
+        self._lists = None          # (rows ordered by list, list start offsets), built on demand
+        self._saved = (None, 0)     # directory and the rows of assign.npy written to it
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, nlist: int = None, iters: int = 10, seed: int = 0) -> "IVFIndex":
+        """Spherical k-means on a sample of the rows, then file every row under its nearest centroid."""
+        rng = np.random.default_rng(seed)
+        nlist = min(nlist or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), min(len(vectors), 64 * nlist), replace=False))])
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iters):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(labels, kind="stable")
+            counts = np.bincount(labels, minlength=nlist)
+            filled = counts > 0
+            centroids[filled] = np.add.reduceat(sample[order], np.r_[0, np.cumsum(counts)[:-1]][filled])
+            centroids[~filled] = sample[rng.choice(len(sample), int((~filled).sum()))]  # re-seed empty lists
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-10
+        index = cls(centroids, np.zeros(0, dtype=np.int32))
+        index.add(vectors)
+        return index
+
+    def add(self, vectors: np.ndarray):
+        """File new rows under their nearest centroid (incremental, no retraining)."""
+        labels = [np.argmax(vectors[i:i + 65536] @ self.centroids.T, axis=1) for i in range(0, len(vectors), 65536)]
+        self.assign = np.concatenate([self.assign, *labels]).astype(np.int32)
+        self._lists = None
+
+    def compact(self, keep: np.ndarray):
+        self.assign, self._lists, self._saved = np.asarray(self.assign)[keep], None, (None, 0)
+
+    def search(self, matrix: np.ndarray, queries: np.ndarray, dead: np.ndarray, top_k: int,
+               nprobe: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Score only the rows in each query's `nprobe` nearest lists."""
+        if self._lists is None:
+            order = np.argsort(self.assign, kind="stable")
+            self._lists = order, np.searchsorted(np.asarray(self.assign)[order], np.arange(len(self.centroids) + 1))
+        order, ptr = self._lists
+        results = []
+        for query, lists in zip(queries, top_k_rows(queries @ self.centroids.T, nprobe)[0]):
+            rows = np.sort(np.concatenate([order[ptr[l]:ptr[l + 1]] for l in lists]))
+            rows = rows[~dead[rows]]
+            idx, top = top_k_rows((matrix[rows] @ query)[None, :], top_k)
+            results.append((rows[idx[0]], top[0]))
+        return results
+
+    def save(self, path: Path):
+        """Centroids are written once per training; rows filed since the last save are appended."""
+        same = self._saved[0] is not None and Path(self._saved[0]).resolve() == path.resolve()
+        path.mkdir(parents=True, exist_ok=True)
+        if not same:
+            _write_atomic(path / "centroids.npy", lambda f: np.save(f, self.centroids))
+        _save_rows(path / "assign.npy", self.assign, self._saved[1] if same else 0)
+        self._saved = (path, len(self.assign))
+
+    @classmethod
+    def load(cls, path: Path) -> "IVFIndex":
+        index = cls(np.load(path / "centroids.npy"), np.load(path / "assign.npy", mmap_mode="r"))
+        index._saved = (path, len(index.assign))
+        return index
+
+class RateLimiter:
+    """Thread-safe limiter spacing acquisitions evenly at `per_minute` (0 = unlimited)."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60 / per_minute if per_minute else 0
+        self.next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self.next)
+            self.next = slot + self.interval
+        time.sleep(slot - now)
+
+class QueryCache:
+    """Persistent two-level LRU/TTL cache (retrieval results, final answers) tied to one index version."""
+    LEVELS = ("retrieval", "answers")
+
+    def __init__(self, path: Path, version: str, max_entries: int = 1000, ttl: float = 7 * 86400):
+        self.path, self.max_entries, self.ttl = path, max_entries, ttl
+        data = json.loads(path.read_text()) if path is not None and path.exists() else {}
+        self.version = data.get("version")
+        self.stats = data.get("stats") or {level: {"hits": 0, "misses": 0, "saved_ms": 0.0} for level in self.LEVELS}
+        self.entries = {level: OrderedDict(data.get(level, {})) for level in self.LEVELS}
+        self._lock = threading.Lock()  # batch/serve modes share one cache across threads
+        self.invalidate(version)
+
+    def invalidate(self, version: str):
+        """Drop every entry if the index changed since they were cached."""
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                for entries in self.entries.values():
+                    entries.clear()
+
+    def get(self, level: str, key: str):
+        entries, stats = self.entries[level], self.stats[level]
+        with self._lock:
+            entry = entries.get(key)
+            if entry is None or time.time() - entry["t"] > self.ttl:
+                entries.pop(key, None)
+                stats["misses"] += 1
+                return None
+            entries.move_to_end(key)
+            stats["hits"] += 1
+            stats["saved_ms"] += entry["ms"]
+            return entry["value"]
+
+    def put(self, level: str, key: str, value, ms: float):
+        """Store a value with the latency it cost, evicting least recently used entries."""
+        entries = self.entries[level]
+        with self._lock:
+            entries[key] = {"value": value, "t": time.time(), "ms": ms}
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def report(self) -> Dict[str, dict]:
+        return {level: dict(stats, entries=len(self.entries[level]),
+                             hit_rate=stats["hits"] / max(stats["hits"] + stats["misses"], 1))
+                for level, stats in self.stats.items()}
+
+    def clear(self):
+        self.stats = {level: {"hits": 0, "misses": 0, "saved_ms": 0.0} for level in self.LEVELS}
+        for entries in self.entries.values():
+            entries.clear()
+
+    def save(self):
+        with self._lock:
+            data = json.dumps({"version": self.version, "stats": self.stats, **self.entries})
+        _write_atomic(self.path, lambda f: f.write(data.encode()))
+
 class MiniRAG:
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, dim: int = EMBED_DIM):
         self.client = Anthropic(api_key=api_key or os.getenv("ANTHROPIC_API_KEY"))
-        self.documents: List[dict] = []
-        self.embeddings: List[np.ndarray] = []
+        self.dim = dim
+        self.documents = ChunkStore()
+        self._matrix = np.zeros((0, dim), dtype=np.float32)  # capacity grows by doubling
+        self._dead = np.zeros(0, dtype=bool)                  # tombstones, same capacity as _matrix
+        self._size = 0
+        self._manifest: Dict[str, dict] = {}  # see manifest
+        self._manifest_path: Path = None     # manifest.json, parsed on first use after load()
+        self.bm25 = BM25Index()
+        self.metadata = MetadataIndex()  # per-row source/date/tags for search filters
+        self.ann: IVFIndex = None  # optional, see build_ann()
+        self.nprobe = ANN_PROBES   # IVF lists scanned per query; 0 forces exact search
+        self.chunk_tokens, self.chunk_overlap = CHUNK_TOKENS, CHUNK_OVERLAP
+        self.tags: List[str] = []  # recorded on every chunk indexed from files from now on
+        self.cache: QueryCache = None
+        self.version = os.urandom(8).hex()  # changes on every mutation; invalidates the cache
+        self.last_timing: Dict[str, float] = {}  # retrieval/first-token/total ms of the last query
+        self.quantize: str = None  # "float16"/"int8": search scans a quantized copy of the matrix
+        self.rescore = RESCORE     # exact rescoring of rescore * top_k quantized candidates; 0 = off
+        self._qmatrix, self._qscale = None, None
+        self._saved = (None, None, 0)  # directory last loaded from or saved to, its version and matrix rows
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """Contiguous (chunks, dim) float32 view of the embedding matrix."""
+        return self._matrix[:self._size]
+
+    @property
+    def manifest(self) -> Dict[str, dict]:
+        """Resolved path -> mtime, size, sha256 and its row range; read from disk when indexing first needs it."""
+        if self._manifest is None:
+            self._load_manifest()
+        return self._manifest
+
+    @manifest.setter
+    def manifest(self, manifest: Dict[str, dict]):
+        self._manifest = manifest
+
+    @property
+    def count(self) -> int:
+        """Number of live (not tombstoned) chunks."""
+        return self._size - int(self._dead[:self._size].sum())
+
+    def _append_embeddings(self, vectors: np.ndarray):
+        """Append rows, doubling the matrix capacity when it is full (amortized O(1) per row)."""
+        need = self._size + len(vectors)
+        if need > len(self._matrix):
+            grown = np.zeros((max(need, 2 * len(self._matrix), 1024), self.dim), dtype=np.float32)
+            grown[:self._size] = self.embeddings
+            dead = np.zeros(len(grown), dtype=bool)
+            dead[:self._size] = self._dead[:self._size]
+            self._matrix, self._dead = grown, dead
+        self._matrix[self._size:need] = vectors
+        self._size = need
+        self.version = os.urandom(8).hex()
+        if self.ann is not None:
+            self.ann.add(vectors)
 
     def simple_embedding(self, text: str) -> np.ndarray:
-        """Create simple word-frequency based embedding (no API needed)."""
-        words = text.lower().split()
-        vocab = sorted(set(words))
-        vector = np.zeros(min(len(vocab), 100))
-        for i, word in enumerate(vocab[:100]):
-            vector[i] = words.count(word) / len(words)
-        return vector / (np.linalg.norm(vector) + 1e-10)
+        """Embed a single text (e.g. a query) with the shared hashed vectorizer."""
+        return hash_embed([text], self.dim)[0]
+
+    def add_chunks(self, chunks: List[str], metadatas: List[dict], analyzed: Tuple[np.ndarray, Postings] = None,
+                   store_text: bool = True):
+        """Embed and index a batch of chunks in one pass (unless already analyzed) and append them.
+
+        With store_text=False only the metadata is kept; the text is read back from its
+        source byte range (metadata "offset") when the chunk is retrieved.
+        """
+        vectors, postings = analyzed or analyze(chunks, self.dim)
+        self.documents.extend({"content": c, "metadata": m} if store_text else {"metadata": m}
+                              for c, m in zip(chunks, metadatas))
+        self.bm25.add(self._size, postings)
+        self.metadata.add(self._size, metadatas)
+        self._append_embeddings(vectors)
 
     def add_document(self, content: str, metadata: dict = None):
         """Add a document to the knowledge base."""
-        chunks = [content[i:i+1000] for i in range(0, len(content), 1000)]
-        for chunk in chunks:
-            self.documents.append({"content": chunk, "metadata": metadata or {}})
-            self.embeddings.append(self.simple_embedding(chunk))
+        chunks = [text for text, _, _ in iter_chunks(io.BytesIO(content.encode()), self.chunk_tokens, self.chunk_overlap)]
+        self.add_chunks(chunks, [metadata or {}] * len(chunks))
 
     def add_file(self, filepath: str):
-        """Add a file to the knowledge base."""
-        path = Path(filepath)
-        self.add_document(path.read_text(), {"source": filepath, "filename": path.name})
-
-    def add_directory(self, dirpath: str, extensions: List[str] = [".txt", ".md"]):
-        """Add all files from directory."""
-        for ext in extensions:
-            for file in Path(dirpath).rglob(f"*{ext}"):
-                try:
-                    print(f"Adding {file}...")
-                    self.add_file(str(file))
-                except Exception as e:
-                    print(f"Error adding {file}: {e}")
-
-    def search(self, query: str, top_k: int = 3) -> List[Tuple[dict, float]]:
-        """Search documents by similarity."""
-        query_emb = self.simple_embedding(query)
-        scores = [np.dot(query_emb, doc_emb) for doc_emb in self.embeddings]
-        top_indices = np.argsort(scores)[-top_k:][::-1]
-        return [(self.documents[i], scores[i]) for i in top_indices]
-
-    def query(self, question: str, top_k: int = 3) -> str:
-        """Query the knowledge base."""
-        results = self.search(question, top_k)
+        """Add a file to the knowledge base (skipped if unchanged since it was indexed)."""
+        path = Path(filepath).resolve()
+        self.ingest([(path, path.stat())], workers=1)
+
+    def add_directory(self, dirpath: str, extensions: List[str] = [".txt", ".md"], workers: int = None):
+        """Index new and changed files under dirpath and tombstone the ones that were deleted."""
+        seen, dirpath = set(), str(Path(dirpath).resolve())  # one spelling per file: absolute, symlinks resolved
+        def walk():
+            for path, stat in walk_files(dirpath, extensions):
+                seen.add(str(path))
+                yield path, stat
+        self.ingest(walk(), workers)
+        self._prune(dirpath, extensions, seen)
+
+    def _prune(self, dirpath: str, extensions: List[str], seen: set):
+        """Tombstone indexed files under dirpath that were not seen by the last walk."""
+        root = Path(dirpath).resolve().parts
+        for key in [k for k in self.manifest if k not in seen and Path(k).suffix in extensions
+                    and Path(k).parts[:len(root)] == root]:
+            print(f"Removing {key}...")
+            self._tombstone(key)
+
+    def ingest(self, files: Iterable[Tuple[Path, os.stat_result]], workers: int = None,
+               max_chunks: int = None) -> List[Tuple[Path, os.stat_result]]:
+        """Streaming pipeline: skip unchanged files, read on threads, chunk+embed on processes, append in order.
+
+        With max_chunks, stops once the index holds that many chunks (checked after each file,
+        so the last file may overshoot) and returns the files it took but did not index.
+        """
+        workers = workers or os.cpu_count() or 1
+        window, reads, embeds = 4 * workers, deque(), deque()
+        batch, stats = [], {"files": 0, "bytes": 0, "skipped": 0, "start": time.perf_counter(), "limit": max_chunks}
+        stats["shown"] = stats["start"]
+        with ThreadPoolExecutor(min(32, 2 * workers)) as io_pool, \
+             (ProcessPoolExecutor(workers) if workers > 1 else ThreadPoolExecutor(1)) as cpu_pool:
+            for path, stat in files:
+                entry = self.manifest.get(str(path))
+                if entry and (entry["mtime"], entry["size"]) == (stat.st_mtime, stat.st_size):
+                    stats["skipped"] += 1
+                    continue
+                reads.append((path, stat, io_pool.submit(_read_hashed, path)))
+                while len(reads) > window or (reads and reads[0][2].done()):
+                    self._route(reads.popleft(), embeds, cpu_pool, stats)
+                while not stats.get("full") and (len(embeds) > window or (embeds and embeds[0][3].done())):
+                    self._collect(embeds.popleft(), batch, stats)
+                if stats.get("full"):
+                    break
+            while reads and not stats.get("full"):
+                self._route(reads.popleft(), embeds, cpu_pool, stats)
+            while embeds and not stats.get("full"):
+                self._collect(embeds.popleft(), batch, stats)
+            left = [(path, stat) for path, stat, *_ in list(embeds) + list(reads)]  # embeds were read first
+            for *_, future in list(embeds) + list(reads):
+                if future is not None:
+                    future.cancel()
+        self._flush(batch)
+        elapsed = max(time.perf_counter() - stats["start"], 1e-9)
+        print(f"\r✓ Ingested {stats['files']} files ({stats['bytes'] / 1e6:.1f} MB) in {elapsed:.1f}s: "
+              f"{stats['files'] / elapsed:.0f} files/s, {stats['bytes'] / 1e6 / elapsed:.1f} MB/s, "
+              f"{stats['skipped']} unchanged", " " * 10)
+        return left
+
+    def _route(self, item, embeds: deque, cpu_pool, stats: dict):
+        """Drop files whose content hash is unchanged; send the rest to the chunk+embed pool."""
+        path, stat, future = item
+        try:
+            data, digest = future.result()
+        except Exception as e:
+            print(f"\nError adding {path}: {e}")
+            return
+        entry = self.manifest.get(str(path))
+        if entry and entry["sha256"] == digest:  # touched but not modified
+            entry["mtime"] = stat.st_mtime
+            stats["skipped"] += 1
+            return
+        stats["bytes"] += stat.st_size
+        future = None if data is None else cpu_pool.submit(_chunk_and_embed, data, self.dim, self.chunk_tokens, self.chunk_overlap)
+        embeds.append((path, stat, digest, future))
+
+    def _collect(self, item, batch: list, stats: dict):
+        """Queue one file's chunks for the next ordered append, in walk order."""
+        path, stat, digest, future = item
+        if future is None:  # too large to hold in memory: stream it straight into the index
+            self._flush(batch)
+            stats["pending"] = 0
+            self._ingest_stream(path, stat, digest)
+        else:
+            batch.append((path, stat, digest) + future.result())
+            stats["pending"] = stats.get("pending", 0) + len(batch[-1][3])
+        stats["files"] += 1
+        stats["full"] = bool(stats["limit"]) and self._size + stats["pending"] >= stats["limit"]
+        if stats["pending"] >= EMBED_BATCH:
+            self._flush(batch)
+            stats["pending"] = 0
+        now = time.perf_counter()
+        if now - stats["shown"] > 1:
+            elapsed, stats["shown"] = now - stats["start"], now
+            print(f"\r  {stats['files']} files, {stats['bytes'] / 1e6:.1f} MB "
+                  f"({stats['files'] / elapsed:.0f} files/s, {stats['bytes'] / 1e6 / elapsed:.1f} MB/s)", end="", flush=True)
+
+    def _ingest_stream(self, path: Path, stat: os.stat_result, digest: str):
+        """Chunk a large file from disk in bounded memory; chunk text stays in the source file."""
+        key, start, texts, metadatas = str(path), self._size, [], []
+        if key in self.manifest:
+            self._tombstone(key)
+        with open(path, "rb") as f:
+            for text, begin, end in iter_chunks(f, self.chunk_tokens, self.chunk_overlap):
+                texts.append(text)
+                metadatas.append(self._file_metadata(path, stat, [begin, end]))
+                if len(texts) == EMBED_BATCH:
+                    self.add_chunks(texts, metadatas, store_text=False)
+                    texts, metadatas = [], []
+        self.add_chunks(texts, metadatas, store_text=False)
+        self.manifest[key] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": digest,
+                              "start": start, "count": self._size - start}
+
+    def _flush(self, batch: list):
+        """Append a batch of embedded files and record their row ranges in the manifest."""
+        if not batch:
+            return
+        chunks, metadatas, postings = [], [], []
+        for path, stat, digest, file_chunks, offsets, _, (rows, *rest) in batch:
+            key = str(path)
+            if key in self.manifest:
+                self._tombstone(key)
+            self.manifest[key] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": digest,
+                                  "start": self._size + len(chunks), "count": len(file_chunks)}
+            postings.append((rows + np.uint32(len(chunks)), *rest))
+            chunks += file_chunks
+            metadatas += [self._file_metadata(path, stat, o) for o in offsets]
+        merged = tuple(np.concatenate(p) for p in zip(*postings))
+        self.add_chunks(chunks, metadatas, (np.concatenate([b[5] for b in batch]), merged))
+        batch.clear()
+
+    def _file_metadata(self, path: Path, stat: os.stat_result, offset: list) -> dict:
+        meta = {"source": str(path), "filename": path.name, "offset": offset, "date": stat.st_mtime}
+        return dict(meta, tags=self.tags) if self.tags else meta
+
+    def _tombstone(self, key: str):
+        """Drop a file from the manifest and mark its rows dead until the next compaction."""
+        entry = self.manifest.pop(key)
+        self._dead[entry["start"]:entry["start"] + entry["count"]] = True
+        self.version = os.urandom(8).hex()
+
+    def compact(self) -> int:
+        """Physically remove tombstoned rows and renumber the manifest; returns rows removed."""
+        dead = self._dead[:self._size]
+        removed = int(dead.sum())
+        if not removed:
+            return 0
+        keep = np.flatnonzero(~dead)
+        new_row = np.cumsum(~dead) - 1
+        for entry in self.manifest.values():
+            if entry["count"]:
+                entry["start"] = int(new_row[entry["start"]])
+        self.documents = self.documents.select(keep)
+        self.bm25.compact(~dead)
+        self.metadata.compact(~dead)
+        if self.ann is not None:
+            self.ann.compact(~dead)
+        self._matrix, self._size = np.ascontiguousarray(self.embeddings[keep]), len(keep)
+        self._qmatrix, self._qscale = None, None
+        self._dead = np.zeros(self._size, dtype=bool)
+        self.version = os.urandom(8).hex()
+        self._saved = (self._saved[0], None, 0)  # every row moved: the next save rewrites the matrix
+        return removed
+
+    def search(self, query: str, top_k: int = 3, mode: str = "dense", filters: dict = None) -> List[Tuple[dict, float]]:
+        """Search documents by similarity (dense), keywords (bm25) or both fused (hybrid).
+
+        filters restricts scoring to matching chunks, e.g. {"prefix": "docs/team-a", "ext": ".md",
+        "tags": ["runbook"], "since": "2024-01-01"}; see MetadataIndex.mask.
+        """
+        return self.search_batch([query], top_k, mode, filters)[0]
+
+    def search_batch(self, queries: List[str], top_k: int = 3, mode: str = "dense",
+                     filters: dict = None) -> List[List[Tuple[dict, float]]]:
+        """Search many queries; dense scoring is one matrix-matrix product and a partial sort."""
+        return [[(self.documents[i], float(s)) for i, s in zip(rows, scores)]
+                for rows, scores in self._search_rows(queries, top_k, mode, filters)]
+
+    def _search_rows(self, queries: List[str], top_k: int, mode: str,
+                     filters: dict = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """(row ids, scores) per query, best first, served from the retrieval cache when possible."""
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {SEARCH_MODES}")
+        if self.cache is None:
+            return self._retrieve(queries, top_k, mode, filters)
+        self.cache.invalidate(self.version)
+        keys = [self._cache_key(q, top_k, mode, filters) for q in queries]
+        hits = [self.cache.get("retrieval", key) for key in keys]
+        missing = [i for i, hit in enumerate(hits) if hit is None]
+        if missing:
+            start = time.perf_counter()
+            found = self._retrieve([queries[i] for i in missing], top_k, mode, filters)
+            ms = (time.perf_counter() - start) * 1000 / len(missing)
+            for i, (rows, scores) in zip(missing, found):
+                hits[i] = [rows.tolist(), scores.tolist()]
+                self.cache.put("retrieval", keys[i], hits[i], ms)
+        return [(np.array(rows, dtype=np.int64), np.array(scores, dtype=np.float32)) for rows, scores in hits]
+
+    def _cache_key(self, query: str, top_k: int, mode: str, filters: dict = None) -> str:
+        """Retrieval cache key: the normalized query plus every setting that changes the result."""
+        return json.dumps([" ".join(tokenize(query)), top_k, mode, self.nprobe if self.ann else 0,
+                           self.rescore if self.quantize else None, filters or None], sort_keys=True)
+
+    def _retrieve(self, queries: List[str], top_k: int, mode: str, filters: dict = None,
+                  bm25_stats: list = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Uncached retrieval; hybrid fuses dense and BM25 ranks with reciprocal rank fusion.
+
+        bm25_stats holds per-query BM25Index.term_stats of a larger corpus (see ShardedRAG).
+        """
+        dead = self._dead[:self._size]
+        if filters:
+            dead = dead | ~self.metadata.mask(filters, self._size)
+        stats = bm25_stats or [None] * len(queries)
+        if mode == "bm25":
+            return [self.bm25.search(q, dead, top_k, s) for q, s in zip(queries, stats)]
+        pool = top_k if mode == "dense" else max(4 * top_k, 20)
+        dense = self._dense_rows(hash_embed(queries, self.dim), pool, self.nprobe, dead)
+        if mode == "dense":
+            return dense
+        return [rrf_fuse([dense_rows, self.bm25.search(q, dead, pool, s)[0]], top_k)
+                for q, s, (dense_rows, _) in zip(queries, stats, dense)]
+
+    def _dense_rows(self, vectors: np.ndarray, top_k: int, nprobe: int,
+                    dead: np.ndarray = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Exact brute-force scoring, or IVF probing when an ANN index exists and nprobe > 0.
+
+        `dead` marks rows that must not be returned (tombstones, rows excluded by filters).
+        When most rows are excluded only the rest are scored, and IVF probing is skipped.
+        """
+        dead = self._dead[:self._size] if dead is None else dead
+        if self.ann is not None and nprobe and self._selective(dead) is None:
+            return self.ann.search(self.embeddings, vectors, dead, top_k, nprobe)
+        if self.quantize:
+            return self._quantized_rows(vectors, top_k, self.rescore, dead)
+        return self._exact_rows(vectors, top_k, dead)
+
+    def _selective(self, dead: np.ndarray) -> Optional[np.ndarray]:
+        """Ids of the rows to score when most are excluded (cheaper to gather), else None."""
+        return np.flatnonzero(~dead) if len(dead) and dead.mean() > 0.5 else None
+
+    def _exact_rows(self, vectors: np.ndarray, top_k: int, dead: np.ndarray = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        dead = self._dead[:self._size] if dead is None else dead
+        live = self._selective(dead)
+        matrix = self.embeddings if live is None else self.embeddings[live]
+        results = []
+        for i in range(0, len(vectors), 256):  # bounds the (queries, chunks) score matrix
+            scores = vectors[i:i + 256] @ matrix.T
+            if live is None:
+                scores[:, dead] = -np.inf
+            idx, top = top_k_rows(scores, top_k)
+            if live is not None:
+                idx = live[idx]
+            results += [(rows[vals > -np.inf], vals[vals > -np.inf]) for rows, vals in zip(idx, top)]
+        return results
+
+    def _quantized(self) -> Tuple[np.ndarray, np.ndarray]:
+        """The quantized matrix and row scales, extended with rows appended since they were built."""
+        if self._qmatrix is None or self._qmatrix.dtype != np.dtype(self.quantize):
+            self._qmatrix, self._qscale = quantize(self.embeddings, self.quantize)
+        elif len(self._qmatrix) < self._size:
+            rows, scale = quantize(self.embeddings[len(self._qmatrix):], self.quantize)
+            self._qmatrix = np.concatenate([self._qmatrix, rows])
+            self._qscale = None if scale is None else np.concatenate([self._qscale, scale])
+        return self._qmatrix, self._qscale
+
+    def _quantized_rows(self, vectors: np.ndarray, top_k: int, rescore: int,
+                        dead: np.ndarray = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Score against the quantized matrix, then optionally rescore the best candidates exactly.
+
+        Rescoring reads only the candidate rows of the float32 matrix, which stays memory-mapped.
+        """
+        matrix, scale = self._quantized()
+        dead = self._dead[:self._size] if dead is None else dead
+        live = self._selective(dead)
+        if live is not None:
+            matrix, scale = matrix[live], None if scale is None else scale[live]
+        results = []
+        for i in range(0, len(vectors), 256):
+            block = vectors[i:i + 256]
+            scores = np.empty((len(block), len(matrix)), dtype=np.float32)
+            for j in range(0, len(matrix), QUANT_BLOCK):
+                scores[:, j:j + QUANT_BLOCK] = block @ matrix[j:j + QUANT_BLOCK].astype(np.float32).T
+            if scale is not None:
+                scores *= scale
+            if live is None:
+                scores[:, dead] = -np.inf
+            idx, top = top_k_rows(scores, top_k * rescore if rescore else top_k)
+            if live is not None:
+                idx = live[idx]
+            for query, rows, vals in zip(block, idx, top):
+                rows = rows[vals > -np.inf]
+                if not rescore:
+                    results.append((rows, vals[vals > -np.inf]))
+                    continue
+                rows = np.sort(rows)  # ascending reads from the memory map
+                exact = self.embeddings[rows] @ query
+                best = np.argsort(-exact, kind="stable")[:top_k]
+                results.append((rows[best], exact[best]))
+        return results
+
+    def set_quantize(self, kind: str = None):
+        """Search a float16/int8 copy of the embeddings from now on (None = float32 only)."""
+        if kind not in (None,) + QUANT_KINDS:
+            raise ValueError(f"Unknown quantization '{kind}', expected one of {QUANT_KINDS}")
+        self.quantize, self._qmatrix, self._qscale = kind, None, None
+        self.version = os.urandom(8).hex()
+
+    def quantize_report(self, queries: int = 200, top_k: int = 10) -> List[dict]:
+        """Memory and recall@k of quantized search, with and without rescoring, against exact float32."""
+        live = np.flatnonzero(~self._dead[:self._size])
+        sample = self.embeddings[np.random.default_rng(0).choice(live, min(queries, len(live)), replace=False)]
+        def timed(search, *args):
+            start = time.perf_counter()
+            rows = [r for r, _ in search(sample, top_k, *args)]
+            return rows, (time.perf_counter() - start) * 1000 / max(len(sample), 1)
+        exact, exact_ms = timed(self._exact_rows)
+        report = [{"kind": "float32", "rescore": 0, "mb": self.embeddings.nbytes / 1e6, "recall": 1.0, "ms_per_query": exact_ms}]
+        matrix, scale = self._quantized()
+        mb = (matrix.nbytes + (0 if scale is None else scale.nbytes)) / 1e6
+        for rescore in sorted({0, self.rescore or RESCORE}):
+            approx, ms = timed(self._quantized_rows, rescore)
+            recall = np.mean([len(np.intersect1d(a, e)) / max(len(e), 1) for a, e in zip(approx, exact)])
+            report.append({"kind": self.quantize, "rescore": rescore, "mb": mb, "recall": float(recall), "ms_per_query": ms})
+        return report
+
+    def build_ann(self, nlist: int = None):
+        """Train the IVF index over the live rows (tombstoned rows are compacted first)."""
+        self.compact()
+        self.ann = IVFIndex.train(self.embeddings, nlist)
+        self.version = os.urandom(8).hex()
+
+    def ann_report(self, queries: int = 200, top_k: int = 10, probes=(1, 2, 4, 8, 16, 32)) -> List[dict]:
+        """Recall@k and latency of IVF search against exact search, using stored chunks as queries."""
+        live = np.flatnonzero(~self._dead[:self._size])
+        sample = self.embeddings[np.random.default_rng(0).choice(live, min(queries, len(live)), replace=False)]
+        def timed(nprobe):
+            start = time.perf_counter()
+            rows = [r for r, _ in (self._dense_rows(sample, top_k, nprobe) if nprobe else self._exact_rows(sample, top_k))]
+            return rows, (time.perf_counter() - start) * 1000 / max(len(sample), 1)
+        exact, exact_ms = timed(0)
+        report = [{"nprobe": 0, "recall": 1.0, "ms_per_query": exact_ms}]
+        for nprobe in probes:
+            if nprobe > len(self.ann.centroids):
+                break
+            approx, ms = timed(nprobe)
+            recall = np.mean([len(np.intersect1d(a, e)) / max(len(e), 1) for a, e in zip(approx, exact)])
+            report.append({"nprobe": nprobe, "recall": float(recall), "ms_per_query": ms})
+        return report
+
+    def query(self, question: str, top_k: int = 3, mode: str = "dense", filters: dict = None) -> str:
+        """Query the knowledge base (answers are cached per question and retrieved chunk ids)."""
+        return "".join(self.query_stream(question, top_k, mode, filters))
+
+    def query_stream(self, question: str, top_k: int = 3, mode: str = "dense", filters: dict = None) -> Iterator[str]:
+        """Yield the answer as text deltas arrive; timings land in self.last_timing."""
+        start = time.perf_counter()
+        rows, scores = self._search_rows([question], top_k, mode, filters)[0]
+        self.last_timing = {"retrieval_ms": (time.perf_counter() - start) * 1000}
+        yield from self._generate(question, rows, scores, self.last_timing)
+
+    def query_batch(self, questions: List[str], top_k: int = 3, mode: str = "dense", concurrency: int = 8,
+                    per_minute: float = 50, filters: dict = None) -> Iterator[dict]:
+        """Answer many questions: one retrieval pass, then rate-limited concurrent model calls (in order)."""
+        start = time.perf_counter()
+        hits = self._search_rows(questions, top_k, mode, filters)
+        retrieval_ms = (time.perf_counter() - start) * 1000 / max(len(questions), 1)
+        limiter = RateLimiter(per_minute)
+
+        def answer(question: str, rows: np.ndarray, scores: np.ndarray) -> dict:
+            timing = {"retrieval_ms": retrieval_ms}
+            try:
+                text = "".join(self._generate(question, rows, scores, timing, limiter))
+            except Exception as e:
+                return {"question": question, "error": str(e)}
+            sources = [self.documents[i]["metadata"].get("source") for i in rows]
+            return {"question": question, "answer": text, "sources": sources, **timing}
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            yield from pool.map(answer, questions, *zip(*hits)) if hits else ()
+
+    def _generate(self, question: str, rows: np.ndarray, scores: np.ndarray, timing: dict,
+                  limiter: RateLimiter = None) -> Iterator[str]:
+        """Stream (or replay from the cache) the answer for already retrieved rows, filling in `timing`.
+
+        `limiter` is acquired only when the model is actually called; cached answers never wait for it.
+        """
+        timing.update(ttft_ms=None, total_ms=None, cached=False)
+        results = [(self.documents[i], float(s)) for i, s in zip(rows, scores)]
+        key = hashlib.sha256(json.dumps([question, rows.tolist()]).encode()).hexdigest()
+        cached = self.cache.get("answers", key) if self.cache is not None else None
+        if cached is not None:
+            timing.update(ttft_ms=timing["retrieval_ms"], total_ms=timing["retrieval_ms"], cached=True)
+            yield cached
+            return
+        if limiter is not None:
+            limiter.acquire()
+        start = time.perf_counter() - timing["retrieval_ms"] / 1000
+        parts, generating = [], time.perf_counter()
+        with self.client.messages.stream(
+            model="claude-3-5-sonnet-20241022",
+            max_tokens=1024,
+            messages=[{"role": "user", "content": self._prompt(question, results)}]
+        ) as stream:
+            for text in stream.text_stream:
+                if not parts:
+                    timing["ttft_ms"] = (time.perf_counter() - start) * 1000
+                parts.append(text)
+                yield text
+        timing["total_ms"] = (time.perf_counter() - start) * 1000
+        if self.cache is not None:
+            self.cache.put("answers", key, "".join(parts), (time.perf_counter() - generating) * 1000)
+
+    def _prompt(self, question: str, results: List[Tuple[dict, float]]) -> str:
         context = "\n\n".join([f"Document {i+1} (relevance: {score:.2f}):\n{doc['content']}"
                                for i, (doc, score) in enumerate(results)])
 
-        prompt = f"""Answer the question based on these documents:
+        return f"""Answer the question based on these documents:
 
 {context}
 
@@ -70,57 +1233,596 @@ Instructions:
 
 Answer:"""
 
-        response = self.client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=1024,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.content[0].text
+    def save(self, dirpath: str):
+        """Save knowledge base as a header, an .npy embedding matrix and an offset-indexed JSONL chunk file.
+
+        Saving back to the directory the index came from appends new rows instead of rewriting
+        the files, and does nothing at all (not even touch header.json) if nothing changed.
+        """
+        root = Path(dirpath)
+        if self._saved[:2] == (root.resolve(), self.version):
+            return
+        root.mkdir(parents=True, exist_ok=True)
+        if self._size and self._dead[:self._size].mean() > COMPACT_RATIO:
+            print(f"✓ Compacted {self.compact()} deleted chunks")
+        rows = self._saved[2] if self._saved[0] == root.resolve() else 0  # already on disk, unchanged
+        self.documents.save(root / "chunks.jsonl", root / "offsets.npy")
+        self.bm25.save(root / "bm25")
+        self.metadata.save(root / "metadata")
+        if self.ann is not None:
+            self.ann.save(root / "ann")
+        _write_atomic(root / "tombstones.npy", lambda f: np.save(f, np.flatnonzero(self._dead[:self._size])))
+        _write_atomic(root / "manifest.json", lambda f: f.write(json.dumps(self.manifest).encode()))
+        _save_rows(root / "embeddings.npy", self.embeddings, rows)
+        if self.quantize:
+            matrix, scale = self._quantized()
+            _save_rows(root / "quantized.npy", matrix, rows)
+            if scale is not None:
+                _save_rows(root / "scales.npy", scale, rows)
+        for name in ["quantized.npy"] * (not self.quantize) + ["scales.npy"] * (self.quantize != "int8"):
+            (root / name).unlink(missing_ok=True)
+        header = {"format": KB_FORMAT, "dim": self.dim, "count": self._size, "version": self.version,
+                  "quantize": self.quantize, "resolved_paths": True}
+        _write_atomic(root / "header.json", lambda f: f.write(json.dumps(header).encode()))
+        self._saved = (root.resolve(), self.version, self._size)
+
+    def load(self, dirpath: str):
+        """Load knowledge base: embeddings are memory-mapped and chunk text is read on demand."""
+        root = Path(dirpath)
+        if root.is_file():
+            return self._load_json(root)
+        header = json.loads((root / "header.json").read_text())
+        if header["format"] != KB_FORMAT:
+            raise ValueError(f"Unsupported knowledge base format {header['format']}")
+        self.dim, self._size = header["dim"], header["count"]
+        self.version = header.get("version") or f"{self._size}-{(root / 'embeddings.npy').stat().st_mtime_ns}"
+        self._matrix = np.load(root / "embeddings.npy", mmap_mode="r")  # copied on first append
+        self.quantize = header.get("quantize")
+        if self.quantize:
+            self._qmatrix = np.load(root / "quantized.npy", mmap_mode="r")[:self._size]
+            self._qscale = np.load(root / "scales.npy")[:self._size] if self.quantize == "int8" else None
+        self._dead = np.zeros(len(self._matrix), dtype=bool)
+        self._dead[np.load(root / "tombstones.npy")] = True
+        self._manifest, self._manifest_path = None, root / "manifest.json"
+        if not header.get("resolved_paths"):  # may list a file twice, whose older rows must be tombstoned now
+            self._load_manifest()
+        self.documents = ChunkStore.open(root / "chunks.jsonl", root / "offsets.npy")
+        self.bm25 = BM25Index(root / "bm25")
+        self.metadata = MetadataIndex(root / "metadata")
+        self.ann = IVFIndex.load(root / "ann") if (root / "ann").exists() else None
+        current = header.get("resolved_paths") and (root / "bm25").exists() and (root / "metadata").exists()
+        self._saved = (root.resolve(), self.version if current else None, self._size)  # else: upgrade on save
+        if self._size and not (root / "bm25").exists():  # saved before the keyword index existed
+            self._rebuild_bm25()
+        if self._size and not (root / "metadata").exists():  # saved before search filters existed
+            self._rebuild_metadata()
+
+    def _load_manifest(self):
+        """Parse manifest.json, keyed by resolved path; a file listed under two spellings keeps its newer rows."""
+        self._manifest = {}
+        for key, entry in json.loads(self._manifest_path.read_text()).items():
+            key = str(Path(key).resolve())  # indexes before keys were resolved stored paths as given
+            if key in self._manifest:
+                old, entry = sorted([self._manifest[key], entry], key=lambda e: e["start"])
+                self._dead[old["start"]:old["start"] + old["count"]] = True
+            self._manifest[key] = entry
+
+    def _rebuild_bm25(self):
+        """Re-derive keyword postings from the stored chunk text."""
+        self.bm25, texts = BM25Index(), [chunk_text(doc) for doc in self.documents]
+        for start in range(0, len(texts), EMBED_BATCH):
+            self.bm25.add(start, analyze(texts[start:start + EMBED_BATCH], self.dim)[1])
+
+    def _rebuild_metadata(self):
+        """Re-derive filter columns from stored chunk metadata, dating file chunks by their mtime."""
+        self.metadata = MetadataIndex()
+        metadatas = [doc["metadata"] for doc in self.documents]
+        for meta in metadatas:
+            entry = meta.get("source") and self.manifest.get(str(Path(meta["source"]).resolve()))
+            if "date" not in meta and entry:
+                meta["date"] = entry["mtime"]
+        self.metadata.add(0, metadatas)
+
+    def _load_json(self, filepath: Path):
+        """Load a legacy knowledge_base.json (pre-binary format)."""
+        data = json.loads(filepath.read_text())
+        self.documents = ChunkStore()
+        self.documents.extend(data["documents"])
+        self._matrix, self._size = np.zeros((0, self.dim), dtype=np.float32), 0
+        self._dead, self.manifest, self.ann = np.zeros(0, dtype=bool), {}, None
+        vectors, postings = analyze([d["content"] for d in data["documents"]], self.dim)
+        self.bm25 = BM25Index()
+        self.bm25.add(0, postings)
+        self.metadata = MetadataIndex()
+        self.metadata.add(0, [d["metadata"] for d in data["documents"]])
+        if any(len(e) != self.dim for e in data["embeddings"]):  # saved by the old per-chunk vocabulary embedding
+            self._append_embeddings(vectors)
+        else:
+            self._append_embeddings(np.array(data["embeddings"], dtype=np.float32).reshape(-1, self.dim))
+        for i, doc in enumerate(data["documents"]):  # seed the manifest so the next index replaces, not duplicates
+            source = doc["metadata"].get("source")
+            if source is None:
+                continue
+            source = str(Path(source).resolve())
+            entry = self.manifest.get(source)
+            if entry and entry["start"] + entry["count"] == i:
+                entry["count"] += 1
+                continue
+            if entry:  # the same file was indexed more than once
+                self._tombstone(source)
+            self.manifest[source] = {"mtime": None, "size": None, "sha256": None, "start": i, "count": 1}
+
+    def migrate(self, json_path: str, dirpath: str) -> int:
+        """One-shot conversion of a legacy knowledge_base.json into the binary format."""
+        self._load_json(Path(json_path))
+        self.save(dirpath)
+        return len(self.documents)
 
-    def save(self, filepath: str):
-        """Save knowledge base to file."""
-        data = {"documents": self.documents, "embeddings": [e.tolist() for e in self.embeddings]}
-        Path(filepath).write_text(json.dumps(data))
+class ShardView:
+    """Read-only chunk lookup across shards: global row -> (shard, local row)."""
 
-    def load(self, filepath: str):
-        """Load knowledge base from file."""
-        data = json.loads(Path(filepath).read_text())
-        self.documents = data["documents"]
-        self.embeddings = [np.array(e) for e in data["embeddings"]]
+    def __init__(self, shards: List["MiniRAG"]):
+        self.shards = shards
+        self.bases = np.cumsum([0] + [s._size for s in shards]).tolist()
+
+    def __len__(self) -> int:
+        return self.bases[-1]
+
+    def __getitem__(self, i: int) -> dict:
+        shard = bisect_right(self.bases, i) - 1
+        return self.shards[shard].documents[i - self.bases[shard]]
+
+class ShardedRAG(MiniRAG):
+    """Knowledge base split into independent shards under <kb>/shards/<name>/.
+
+    Each shard is a complete, memory-mapped MiniRAG index. Searches fan out to the
+    shards on a thread pool (NumPy releases the GIL while scoring) and the per-shard
+    top-k lists are merged with a heap. Row ids are global: shard base + local row.
+    """
+
+    def __init__(self, api_key: str = None, dim: int = EMBED_DIM):
+        super().__init__(api_key, dim)
+        self.shards: Dict[str, MiniRAG] = {}
+        self.target = "main"           # shard group that new files are indexed into
+        self.max_chunks: int = None    # roll over to <target>.1, <target>.2, ... past this many chunks
+        self.active: List[str] = None  # restrict search to these shard groups (None = all)
+        self._dirty, self._dropped, self._pool = set(), set(), None
+        self._refresh()
+
+    @property
+    def count(self) -> int:
+        return sum(shard.count for shard in self.shards.values())
+
+    def _refresh(self):
+        """Recompute the global row space and the combined version after shards change."""
+        self.shards = dict(sorted(self.shards.items()))
+        self.documents = ShardView(list(self.shards.values()))
+        state = json.dumps([(name, shard.version) for name, shard in self.shards.items()])
+        self.version = hashlib.sha256(state.encode()).hexdigest()[:16]
+
+    def _shard(self, name: str) -> MiniRAG:
+        """Get or create a shard; shards share this instance's client and settings."""
+        if name not in self.shards:
+            self.shards[name] = MiniRAG(dim=self.dim)
+            self._dropped.discard(name)
+        shard = self.shards[name]
+        shard.client, shard.nprobe, shard.rescore = self.client, self.nprobe, self.rescore
+        shard.chunk_tokens, shard.chunk_overlap, shard.tags = self.chunk_tokens, self.chunk_overlap, self.tags
+        return shard
+
+    def _open_shard(self) -> MiniRAG:
+        """First shard of the target group with room left, creating the next one when all are full."""
+        name, i = self.target, 0
+        while name in self.shards and self.max_chunks and self.shards[name]._size >= self.max_chunks:
+            i += 1
+            name = f"{self.target}.{i}"
+        self._dirty.add(name)
+        return self._shard(name)
+
+    def ingest(self, files: Iterable[Tuple[Path, os.stat_result]], workers: int = None):
+        """Re-index known files in the shard that owns them; new files go to the target group."""
+        owned: Dict[str, list] = {}
+        new = deque()
+        for path, stat in files:
+            owner = next((name for name, shard in self.shards.items() if str(path) in shard.manifest), None)
+            (owned.setdefault(owner, []) if owner else new).append((path, stat))
+        for name, items in owned.items():
+            self._shard(name).ingest(items, workers)
+            self._dirty.add(name)
+        def take():
+            while new:
+                yield new.popleft()
+        while new:  # fill a shard up to max_chunks, then hand what it did not index to the next one
+            left = self._open_shard().ingest(take(), workers, self.max_chunks)
+            new.extendleft(reversed(left))
+        self._refresh()
+
+    def _prune(self, dirpath: str, extensions: List[str], seen: set):
+        for name, shard in self.shards.items():
+            before = shard.version
+            shard._prune(dirpath, extensions, seen)
+            if shard.version != before:
+                self._dirty.add(name)
+        self._refresh()
+
+    def group(self, name: str) -> List[str]:
+        """The shard name plus the <name>.1, <name>.2, ... shards it rolled over into."""
+        return [s for s in self.shards if s == name or (s.startswith(name + ".") and s[len(name) + 1:].isdigit())]
+
+    def drop_shard(self, name: str):
+        """Remove a shard group from the index; its directories are deleted on the next save()."""
+        names = self.group(name)
+        if not names:
+            raise KeyError(f"No shard named '{name}'")
+        for name in names:
+            del self.shards[name]
+            self._dirty.discard(name)
+            self._dropped.add(name)
+        self._refresh()
+
+    def compact(self) -> int:
+        removed = 0
+        for name, shard in self.shards.items():
+            if shard._dead[:shard._size].any():
+                removed += shard.compact()
+                self._dirty.add(name)
+        self._refresh()
+        return removed
+
+    def build_ann(self, nlist: int = None):
+        """Train an IVF index per shard (nlist defaults to sqrt of each shard's chunks)."""
+        for name, shard in self.shards.items():
+            if shard._size:
+                shard.build_ann(nlist)
+                self._dirty.add(name)
+        self._refresh()
+
+    def ann_report(self, queries: int = 200, top_k: int = 10, probes=(1, 2, 4, 8, 16, 32)) -> List[dict]:
+        """Per-shard reports combined: mean recall, summed latency (every shard is probed per query)."""
+        reports = [shard.ann_report(queries, top_k, probes) for shard in self.shards.values() if shard.ann is not None]
+        return [{"nprobe": rows[0]["nprobe"], "recall": float(np.mean([r["recall"] for r in rows])),
+                 "ms_per_query": sum(r["ms_per_query"] for r in rows)} for rows in zip(*reports)]
+
+    def set_quantize(self, kind: str = None):
+        """Quantize every shard (None = float32 only)."""
+        for name, shard in self.shards.items():
+            shard.set_quantize(kind)
+            self._dirty.add(name)
+        self._refresh()
+
+    def quantize_report(self, queries: int = 200, top_k: int = 10) -> List[dict]:
+        """Per-shard reports combined: summed memory and latency, mean recall."""
+        reports = [shard.quantize_report(queries, top_k) for shard in self.shards.values() if shard._size]
+        return [dict(rows[0], mb=sum(r["mb"] for r in rows), recall=float(np.mean([r["recall"] for r in rows])),
+                     ms_per_query=sum(r["ms_per_query"] for r in rows)) for rows in zip(*reports)]
+
+    def _cache_key(self, query: str, top_k: int, mode: str, filters: dict = None) -> str:
+        return json.dumps([" ".join(tokenize(query)), top_k, mode, self.nprobe, self.rescore, self.active,
+                           filters or None], sort_keys=True)
+
+    def _retrieve(self, queries: List[str], top_k: int, mode: str, filters: dict = None,
+                  bm25_stats: list = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Search the active shards in parallel and heap-merge their best-first top-k lists.
+
+        BM25 runs with corpus-wide term statistics so scores compare across shards, and hybrid
+        fuses the merged dense and BM25 rankings, since per-shard fused scores depend on shard ranks.
+        """
+        bases = dict(zip(self.shards, self.documents.bases))
+        names = list(self.shards) if self.active is None else list(dict.fromkeys(n for g in self.active for n in self.group(g)))
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(os.cpu_count() or 1)
+        if mode != "dense":
+            per_query = [[self._shard(name).bm25.term_stats(q) for name in names] for q in queries]
+            bm25_stats = [(sum(s[0] for s in stats), sum(s[1] for s in stats),
+                           {key: sum(s[2][key] for s in stats) for key in stats[0][2]} if stats else {})
+                          for stats in per_query]
+        def merged(mode, k):
+            def search(name):
+                return [(rows + bases[name], scores)
+                        for rows, scores in self._shard(name)._retrieve(queries, k, mode, filters, bm25_stats)]
+            per_shard = list(self._pool.map(search, names))
+            results = []
+            for i in range(len(queries)):
+                lists = [zip(hits[i][1].tolist(), hits[i][0].tolist()) for hits in per_shard]
+                best = list(islice(heapq.merge(*lists, reverse=True), k))
+                results.append((np.array([row for _, row in best], dtype=np.int64),
+                                np.array([score for score, _ in best], dtype=np.float32)))
+            return results
+        if mode != "hybrid":
+            return merged(mode, top_k)
+        pool = max(4 * top_k, 20)
+        return [rrf_fuse([dense[0], bm25[0]], top_k) for dense, bm25 in zip(merged("dense", pool), merged("bm25", pool))]
+
+    def save(self, dirpath: str):
+        """Save changed shards and delete dropped ones; untouched shards are not rewritten."""
+        root = Path(dirpath) / "shards"
+        for name in self._dropped:
+            shutil.rmtree(root / name, ignore_errors=True)
+        for name in self._dirty:
+            self.shards[name].save(root / name)
+        self._dirty, self._dropped = set(), set()
+
+    def load(self, dirpath: str):
+        """Open every shard; an unsharded index in dirpath is moved into the shard 'main' first."""
+        root = Path(dirpath)
+        if (root / "header.json").exists():
+            (root / "shards" / "main").mkdir(parents=True)
+            for item in root.iterdir():
+                if item.name not in ("shards", "cache.json"):
+                    item.rename(root / "shards" / "main" / item.name)
+        for path in sorted((root / "shards").iterdir()) if (root / "shards").exists() else []:
+            if (path / "header.json").exists():
+                self._shard(path.name).load(path)
+        self._refresh()
+
+def _kb_stamp(kb_dir: str) -> list:
+    """mtimes of every header.json; save() writes them last, so a change means a new index on disk."""
+    return sorted((str(p), p.stat().st_mtime_ns) for p in Path(kb_dir).glob("**/header.json"))
+
+class RAGServer(ThreadingHTTPServer):
+    """Keeps one index (and one pooled model client) resident for many concurrent requests."""
+    daemon_threads = True
+    SETTINGS = ("client", "cache", "nprobe", "rescore", "chunk_tokens", "chunk_overlap", "tags")  # kept on reload
+
+    def __init__(self, address: Tuple[str, int], rag: MiniRAG, kb_dir: str):
+        super().__init__(address, RAGHandler)
+        self.rag, self.kb_dir, self.stamp = rag, kb_dir, _kb_stamp(kb_dir)
+        self._lock = threading.Lock()
+
+    def current(self) -> MiniRAG:
+        """The resident index, reloaded first if `rag.py index` has rewritten it since."""
+        stamp = _kb_stamp(self.kb_dir)
+        with self._lock:
+            if stamp != self.stamp:
+                rag = type(self.rag)()
+                for name in self.SETTINGS + ("active",) * isinstance(rag, ShardedRAG):
+                    setattr(rag, name, getattr(self.rag, name))
+                rag.load(self.kb_dir)
+                self.rag, self.stamp = rag, stamp
+            return self.rag
+
+class RAGHandler(BaseHTTPRequestHandler):
+    """GET /health, POST /search {query} and POST /query {question, stream}; options top_k, mode and filters."""
+
+    def _json(self, data: dict, status: int = 200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self._json({"error": f"Unknown endpoint {self.path}"}, 404)
+        rag = self.server.current()
+        self._json({"count": rag.count, "version": rag.version})
+
+    def do_POST(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path not in ("/search", "/query"):
+                return self._json({"error": f"Unknown endpoint {self.path}"}, 404)
+            if not isinstance(body, dict):
+                raise ValueError("Request body must be a JSON object")
+            field = "query" if self.path == "/search" else "question"
+            question, top_k, mode = body[field], body.get("top_k", 3), body.get("mode", "dense")
+            if not isinstance(question, str) or not question.strip():
+                raise ValueError(f"'{field}' must be a non-empty string")
+            if isinstance(top_k, bool) or not isinstance(top_k, int) or top_k < 1:
+                raise ValueError("'top_k' must be a positive integer")
+            if mode not in SEARCH_MODES:
+                raise ValueError(f"'mode' must be one of {', '.join(SEARCH_MODES)}")
+            if not isinstance(body.get("filters") or {}, dict):
+                raise ValueError("'filters' must be an object")
+            rag, start = self.server.current(), time.perf_counter()
+            rows, scores = rag._search_rows([question], top_k, mode, body.get("filters"))[0]
+            timing = {"retrieval_ms": (time.perf_counter() - start) * 1000}
+        except KeyError as e:
+            return self._json({"error": f"Missing field {e}"}, 400)
+        except (TypeError, ValueError) as e:  # malformed values, e.g. a filter of the wrong type
+            return self._json({"error": str(e)}, 400)
+        docs = [rag.documents[i] for i in rows]
+        sources = [doc["metadata"].get("source") for doc in docs]
+        if self.path == "/search":
+            return self._json({"results": [{"source": source, "content": doc["content"], "score": float(score)}
+                                           for doc, source, score in zip(docs, sources, scores)], **timing})
+        answer = rag._generate(question, rows, scores, timing)
+        if not body.get("stream"):
+            try:
+                text = "".join(answer)
+            except Exception as e:
+                return self._json({"error": str(e)}, 502)
+            return self._json({"answer": text, "sources": sources, **timing})
+        self.send_response(200)  # newline-delimited JSON: {"text"} deltas, then sources and timings
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            for text in answer:
+                self.wfile.write(json.dumps({"text": text}).encode() + b"\n")
+                self.wfile.flush()
+            self.wfile.write(json.dumps({"sources": sources, **timing}).encode() + b"\n")
+        except Exception as e:
+            self.wfile.write(json.dumps({"error": str(e)}).encode() + b"\n")
 
 def main():
+    parser = argparse.ArgumentParser(description="Chat with your documents",
+                                     epilog="example: python rag.py index docs/ && python rag.py query 'What is the main topic?'")
+    parser.add_argument("command", choices=["index", "search", "query", "batch", "serve", "compact", "ann", "quantize",
+                                            "cache", "shards"],
+                        help="index <file|dir>: add documents, search/query '<question>': show chunks/ask, "
+                             "batch <questions.jsonl>: answer many questions, serve: keep the index loaded "
+                             "for rag_client.py, "
+                             "compact: drop deleted chunks, ann build|report: approximate search index, "
+                             "quantize float16|int8|off|report: compressed embedding search, "
+                             "cache stats|clear: query cache, shards list|drop: sharded index")
+    parser.add_argument("target", nargs="?", help="File/directory to index, question to ask or ann/cache action")
+    parser.add_argument("--workers", type=int, help="Processes for chunking/embedding (default: all cores)")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS, help="Word tokens per chunk")
+    parser.add_argument("--overlap", type=int, default=CHUNK_OVERLAP, help="Tokens repeated between chunks")
+    parser.add_argument("--mode", choices=SEARCH_MODES, default="dense",
+                        help="Retrieval: dense vectors, bm25 keywords or hybrid (both, rank-fused)")
+    parser.add_argument("--top-k", type=int, default=3, help="Chunks to retrieve")
+    parser.add_argument("--nprobe", type=int, default=ANN_PROBES, help="IVF lists to scan (0 = exact search)")
+    parser.add_argument("--lists", type=int, help="IVF lists for 'ann build' (default: sqrt(chunks))")
+    parser.add_argument("--rescore", type=int, default=RESCORE,
+                        help="Quantized candidates per result rescored in float32 (0 = off)")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the retrieval/answer cache")
+    parser.add_argument("--stream", action="store_true", help="Print the answer as it is generated")
+    parser.add_argument("--prefix", help="Only search files under this path")
+    parser.add_argument("--ext", help="Only search these file extensions (comma-separated, e.g. .md,.txt)")
+    parser.add_argument("--tag", action="append", help="index: tag the indexed chunks; search/query: require the tag "
+                                                       "(repeatable)")
+    parser.add_argument("--since", help="Only search files modified on/after this ISO date")
+    parser.add_argument("--until", help="Only search files modified on/before this ISO date")
+    parser.add_argument("--shard", help="index: shard to add to (default: the directory's name, or a file's directory); "
+                                        "search/query/batch: comma-separated shards to search; shards drop: shard to drop "
+                                        "(a name includes its <name>.1, <name>.2, ... rollovers)")
+    parser.add_argument("--shard-chunks", type=int, help="Start a new shard (<name>.1, <name>.2, ...) past this many chunks")
+    parser.add_argument("--out", default="results.jsonl", help="Output file for 'batch'")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel model calls for 'batch'")
+    parser.add_argument("--rpm", type=float, default=50, help="Model requests per minute for 'batch' (0 = unlimited)")
+    parser.add_argument("--host", default="127.0.0.1", help="Address for 'serve'")
+    parser.add_argument("--port", type=int, default=8765, help="Port for 'serve'")
     if len(sys.argv) < 2:
-        print("Usage:")
-        print("  python rag.py index <file|dir>    # Add documents")
-        print("  python rag.py query '<question>'  # Ask a question")
-        print("\nExample:")
-        print("  python rag.py index docs/")
-        print("  python rag.py query 'What is the main topic?'")
+        parser.print_help()
         sys.exit(1)
+    args = parser.parse_args()
+
+    kb_dir, legacy_file = "knowledge_base", "knowledge_base.json"
+    sharded = (Path(kb_dir) / "shards").exists() or bool(args.command == "index" and (args.shard or args.shard_chunks))
+    if not sharded and (args.shard or args.command == "shards"):  # only `index` turns an index into shards
+        sys.exit("The knowledge base is not sharded; index with --shard <name> to split it into shards")
+    rag = ShardedRAG() if sharded else MiniRAG()
+    rag.nprobe, rag.rescore = args.nprobe, args.rescore
+    rag.chunk_tokens, rag.chunk_overlap = args.chunk_tokens, args.overlap
+    rag.tags = args.tag if args.command == "index" and args.tag else []
+    filters = {"prefix": args.prefix, "ext": args.ext and args.ext.split(","), "since": args.since, "until": args.until,
+               "tags": args.tag if args.command != "index" else None}
+    filters = {field: value for field, value in filters.items() if value} or None
 
-    rag = MiniRAG()
-    kb_file = "knowledge_base.json"
+    if not Path(kb_dir).exists() and Path(legacy_file).exists():
+        count = MiniRAG().migrate(legacy_file, kb_dir)
+        print(f"✓ Migrated {legacy_file} to {kb_dir}/ ({count} chunks); the JSON file can be deleted")
 
-    if Path(kb_file).exists():
-        rag.load(kb_file)
-        print(f"✓ Loaded knowledge base ({len(rag.documents)} documents)")
+    if Path(kb_dir).exists():
+        rag.load(kb_dir)
+        print(f"✓ Loaded knowledge base ({rag.count} documents)")
+        if not args.no_cache:
+            rag.cache = QueryCache(Path(kb_dir) / "cache.json", rag.version)
 
-    command = sys.argv[1]
+    if sharded and args.command == "index":
+        source = Path(args.target).resolve()
+        rag.target = args.shard or (source.parent if source.is_file() else source).name  # files join their directory's shard
+        rag.max_chunks = args.shard_chunks
+    elif sharded and args.shard and args.command != "shards":
+        rag.active = args.shard.split(",")
+        unknown = [name for name in rag.active if not rag.group(name)]
+        if unknown:
+            sys.exit(f"No shard named '{', '.join(unknown)}', see: python rag.py shards")
 
-    if command == "index":
-        path = sys.argv[2]
-        if Path(path).is_file():
-            rag.add_file(path)
+    if args.command == "index":
+        if Path(args.target).is_file():
+            rag.add_file(args.target)
         else:
-            rag.add_directory(path)
-        rag.save(kb_file)
-        print(f"✓ Indexed {len(rag.documents)} document chunks")
-
-    elif command == "query":
-        question = sys.argv[2]
-        answer = rag.query(question)
-        print(f"\n❓ Question: {question}\n")
+            rag.add_directory(args.target, workers=args.workers)
+        rag.save(kb_dir)
+        print(f"✓ Indexed {rag.count} document chunks")
+
+    elif args.command == "ann" and args.target == "build":
+        rag.build_ann(args.lists)
+        rag.save(kb_dir)
+        indexes = [s.ann for s in rag.shards.values() if s.ann is not None] if sharded else [rag.ann]
+        print(f"✓ Built IVF index with {sum(len(a.centroids) for a in indexes)} lists over {rag.count} chunks")
+
+    elif args.command == "ann" and args.target == "report":
+        if not (any(s.ann is not None for s in rag.shards.values()) if sharded else rag.ann is not None):
+            sys.exit("No ANN index, run: python rag.py ann build")
+        print(f"{'nprobe':>8} {'recall@10':>10} {'ms/query':>10}")
+        for row in rag.ann_report():
+            print(f"{row['nprobe'] or 'exact':>8} {row['recall']:>10.3f} {row['ms_per_query']:>10.2f}")
+
+    elif args.command == "quantize" and args.target in QUANT_KINDS + ("off",):
+        rag.set_quantize(None if args.target == "off" else args.target)
+        rag.save(kb_dir)
+        print(f"✓ Search now uses {args.target if args.target != 'off' else 'float32'} embeddings")
+
+    elif args.command == "quantize" and args.target == "report":
+        if not rag.count:
+            sys.exit("Empty knowledge base")
+        if not (any(s.quantize for s in rag.shards.values()) if sharded else rag.quantize):
+            rag.set_quantize("int8")  # preview only, not saved
+        print(f"{'storage':>8} {'rescore':>8} {'MB':>9} {'recall@10':>10} {'ms/query':>10}")
+        for row in rag.quantize_report():
+            print(f"{row['kind']:>8} {row['rescore'] or '-':>8} {row['mb']:>9.1f} {row['recall']:>10.3f} {row['ms_per_query']:>10.2f}")
+
+    elif args.command == "cache" and rag.cache is not None:
+        if args.target == "clear":
+            rag.cache.clear()
+            print("✓ Cache cleared")
+        for level, stats in rag.cache.report().items():
+            print(f"{level:>9}: {stats['entries']} entries, {stats['hits']} hits / {stats['misses']} misses "
+                  f"({stats['hit_rate']:.0%}), {stats['saved_ms'] / 1000:.1f}s saved")
+
+    elif args.command == "shards":
+        if args.target == "drop":
+            if not rag.group(args.shard):
+                sys.exit(f"No shard named '{args.shard}', see: python rag.py shards")
+            names = rag.group(args.shard)
+            rag.drop_shard(args.shard)
+            rag.save(kb_dir)
+            print(f"✓ Dropped shard {', '.join(names)}")
+        for name, shard in rag.shards.items():
+            print(f"{name:>20}: {shard.count} chunks from {len(shard.manifest)} files")
+
+    elif args.command == "compact":
+        print(f"✓ Removed {rag.compact()} deleted chunks")
+        rag.save(kb_dir)
+
+    elif args.command == "search":
+        for i, (doc, score) in enumerate(rag.search(args.target, args.top_k, args.mode, filters), 1):
+            snippet = " ".join(doc["content"].split())[:100]
+            print(f"{i}. [{score:.3f}] {doc['metadata'].get('source', '-')}: {snippet}")
+
+    elif args.command == "query" and args.stream:
+        print(f"\n❓ Question: {args.target}\n\n💡 Answer:")
+        for text in rag.query_stream(args.target, args.top_k, args.mode, filters):
+            print(text, end="", flush=True)
+        timing = rag.last_timing
+        print(f"\n\n⏱ first token {(timing['ttft_ms'] or timing['total_ms']) / 1000:.2f}s, total {timing['total_ms'] / 1000:.2f}s"
+              f"{' (cached)' if timing['cached'] else ''}")
+
+    elif args.command == "batch":
+        lines = [json.loads(line) for line in Path(args.target).read_text().splitlines() if line.strip()]
+        records = [line if isinstance(line, dict) else {"question": line} for line in lines]
+        start = time.perf_counter()
+        with open(args.out, "w") as out:
+            results = rag.query_batch([r["question"] for r in records], args.top_k, args.mode, args.concurrency, args.rpm,
+                                      filters)
+            for i, (record, result) in enumerate(zip(records, results), 1):
+                out.write(json.dumps({**record, **result}) + "\n")
+                print(f"\r  {i}/{len(records)} answered", end="", flush=True)
+        minutes = (time.perf_counter() - start) / 60
+        print(f"\r✓ Answered {len(records)} questions in {minutes * 60:.1f}s "
+              f"({len(records) / max(minutes, 1e-9):.1f} questions/min) → {args.out}")
+
+    elif args.command == "serve":
+        server = RAGServer((args.host, args.port), rag, kb_dir)
+        signal.signal(signal.SIGTERM, signal.default_int_handler)  # save the cache on kill, too
+        print(f"✓ Serving on http://{args.host}:{args.port} (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\n✓ Stopped")
+        server.server_close()
+
+    elif args.command == "query":
+        answer = rag.query(args.target, args.top_k, args.mode, filters)
+        print(f"\n❓ Question: {args.target}\n")
         print(f"💡 Answer:\n{answer}")
 
+    if rag.cache is not None:
+        rag.cache.save()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Thin client for `rag.py serve` - standard library only, so it starts in milliseconds."""
+import os, sys, json, argparse
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+SERVER = os.getenv("MINI_RAG_SERVER", "http://127.0.0.1:8765")
+
+def call(server: str, endpoint: str, payload: dict = None):
+    """POST a JSON payload (GET without one) and return the open response."""
+    data = json.dumps(payload).encode() if payload is not None else None
+    try:
+        return urlopen(Request(server + endpoint, data, {"Content-Type": "application/json"}))
+    except HTTPError as e:
+        sys.exit(f"Error: {json.loads(e.read()).get('error', e.reason)}")
+    except URLError:
+        sys.exit(f"No server at {server}, start one with: python rag.py serve")
+
+def main():
+    parser = argparse.ArgumentParser(description="Ask a running `rag.py serve` daemon",
+                                     epilog="example: python rag_client.py query 'What is the main topic?' --stream")
+    parser.add_argument("command", choices=["search", "query", "health"])
+    parser.add_argument("target", nargs="?", help="Query or question")
+    parser.add_argument("--top-k", type=int, default=3, help="Chunks to retrieve")
+    parser.add_argument("--mode", default="dense", help="Retrieval: dense, bm25 or hybrid")
+    parser.add_argument("--prefix", help="Only search files under this path")
+    parser.add_argument("--ext", help="Only search these file extensions (comma-separated)")
+    parser.add_argument("--tag", action="append", help="Require this tag (repeatable)")
+    parser.add_argument("--since", help="Only search files modified on/after this ISO date")
+    parser.add_argument("--until", help="Only search files modified on/before this ISO date")
+    parser.add_argument("--stream", action="store_true", help="Print the answer as it is generated")
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON response")
+    parser.add_argument("--server", default=SERVER, help="Daemon URL (default: $MINI_RAG_SERVER or %(default)s)")
+    args = parser.parse_args()
+
+    if args.command == "health":
+        print(json.load(call(args.server, "/health")))
+        return
+    if not args.target:
+        parser.error(f"{args.command} needs a query")
+    filters = {"prefix": args.prefix, "ext": args.ext and args.ext.split(","), "tags": args.tag,
+               "since": args.since, "until": args.until}
+    options = {"top_k": args.top_k, "mode": args.mode, "filters": {k: v for k, v in filters.items() if v}}
+
+    if args.command == "search":
+        response = json.load(call(args.server, "/search", {"query": args.target, **options}))
+        if args.json:
+            return print(json.dumps(response))
+        for i, hit in enumerate(response["results"], 1):
+            print(f"{i}. [{hit['score']:.3f}] {hit['source'] or '-'}: {' '.join(hit['content'].split())[:100]}")
+
+    elif args.stream:
+        print(f"\n❓ Question: {args.target}\n\n💡 Answer:")
+        for line in call(args.server, "/query", {"question": args.target, "stream": True, **options}):
+            event = json.loads(line)
+            if "error" in event:
+                sys.exit(f"\nError: {event['error']}")
+            print(event.get("text", ""), end="", flush=True)
+        print(f"\n\n⏱ first token {(event['ttft_ms'] or event['total_ms']) / 1000:.2f}s, total {event['total_ms'] / 1000:.2f}s"
+              f"{' (cached)' if event['cached'] else ''}")
+
+    else:
+        response = json.load(call(args.server, "/query", {"question": args.target, **options}))
+        if args.json:
+            return print(json.dumps(response))
+        print(f"\n❓ Question: {args.target}\n")
+        print(f"💡 Answer:\n{response['answer']}")
+
+if __name__ == "__main__":
+    main()
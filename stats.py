@@ -11,27 +11,35 @@ tool_dirs = [
     "rubber-duck", "so-terminal", "terminal-ai", "voice-to-code",
     "week-recap"
 ]
+exceptions = ["mini-rag/rag.py", "ai-agent/agent.py"]  # over 100 lines on purpose, see CONTRIBUTING.md
 
 ai_tools = []
 for tool_dir in tool_dirs:
    tool_files = glob.glob(f"{tool_dir}/*.py")
    tool_files = [f for f in tool_files if not f.endswith("__init__.py")]
-   
+   if not tool_files:
+       continue
+
+   # one tool per directory: its largest file (helpers such as mini-rag/rag_client.py are not tools)
+   sources = {}
    for file in tool_files:
-       if os.path.exists(file):
-           with open(file, encoding="utf-8") as f:
-               lines = f.readlines()
-               code_lines = [line for line in lines if line.strip() and not line.strip().startswith("#")]
-               if len(lines) <= 100:
-                   ai_tools.append((file, len(lines), len(code_lines)))
+       with open(file, encoding="utf-8") as f:
+           sources[file] = f.readlines()
+   file = max(sources, key=lambda name: len(sources[name]))
+   lines = sources[file]
+   code_lines = [line for line in lines if line.strip() and not line.strip().startswith("#")]
+   ai_tools.append((file, len(lines), len(code_lines)))
+
+small_tools = [tool for tool in ai_tools if tool[1] <= 100]
 
 total_lines = sum(len(open(f, encoding="utf-8").readlines()) for f in files if os.path.exists(f))
 
-print(f"Number of AI Tools (<100 lines): {len(ai_tools)}")
+print(f"Number of AI Tools: {len(ai_tools)} ({len(small_tools)} in 100 lines or less)")
 print(f"Total lines of code: {total_lines}")
 print("\nAI Tools found:")
 for f, total, code in ai_tools:
-    print(f" - {f}: {total} lines total, {code} lines of code")
+    note = " (exception, see CONTRIBUTING.md)" if f in exceptions else " (over 100 lines)" if total > 100 else ""
+    print(f" - {f}: {total} lines total, {code} lines of code{note}")
 
 GITHUB_USER = "josharsh"
 REPO_NAME = "100LinesOfAICode"
@@ -55,7 +63,7 @@ print("\n\n📊 Stats Section:")
 print("\nCopy-paste this before 'Try It Now':\n")
 print(f"""## 📊 Repository Stats
 
-- 🛠️ **{len(ai_tools)} AI Tools** - Each under 100 lines
+- 🛠️ **{len(ai_tools)} AI Tools** - {len(small_tools)} of them in 100 lines or less
 - 🎯 **{total_lines:,} lines** of production-ready code
 - ⚡ **5 minutes** to try any tool
 - 🌟 **Zero dependencies** (except Claude API)